@@ -3,7 +3,7 @@ from geosoup.gdaldefs import OGR_GEOM_DEF, OGR_TYPE_DEF, OGR_FIELD_DEF, \
     GDAL_FIELD_DEF, OGR_FIELD_DEF_INV, GDAL_FIELD_DEF_INV
 from geosoup.regression import RFRegressor, MRegressor, HRFRegressor, _Regressor
 from geosoup.samples import Samples
-from geosoup.raster import Raster, MultiRaster
+from geosoup.raster import Raster, MultiRaster, set_gdal_perf_options
 from geosoup.timer import Timer
 from geosoup.distance import Mahalanobis, Distance, Euclidean
 from geosoup.exceptions import ObjectNotFound, UninitializedError, FieldError, \
@@ -1,16 +1,38 @@
-from decimal import Decimal, getcontext
-from itertools import takewhile, repeat
+from itertools import takewhile, repeat, islice
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
 import numpy as np
 import datetime
 import fnmatch
-import random
-import psutil
 import ftplib
+import mmap
+import operator
+import re
 import copy
 import gzip
+import io
+import math
+import shutil
 import sys
 import os
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pacsv
+except ImportError:
+    pacsv = None
+
 
 __all__ = ['Sublist',
            'Handler',
@@ -18,22 +40,208 @@ __all__ = ['Sublist',
            'Opt']
 
 
+def _moving_average_kernel(arr,
+                           n,
+                           out):
+    """
+    Running sum moving average of a 1d array, written to out.
+    The array edges are padded with the first and last (n-1)/2 elements
+    :param arr: Input 1d array
+    :param n: Kernel size (odd number)
+    :param out: Output 1d array of the same size as arr
+    """
+    size = arr.shape[0]
+    tail = (n - 1) // 2
+
+    running_sum = 0.0
+    for k in range(-tail, tail + 1):
+        if k < 0:
+            running_sum += arr[k + tail]
+        elif k >= size:
+            running_sum += arr[k - tail]
+        else:
+            running_sum += arr[k]
+    out[0] = running_sum / n
+
+    for i in range(1, size):
+        k = i + tail
+        if k >= size:
+            k -= tail
+        running_sum += arr[k]
+
+        k = i - tail - 1
+        if k < 0:
+            k += tail
+        running_sum -= arr[k]
+
+        out[i] = running_sum / n
+
+
+if njit is not None:
+    _moving_average_kernel = njit(cache=True, fastmath=True)(_moving_average_kernel)
+
+
+# random number generator shared by the sampling methods
+_RNG = np.random.default_rng()
+
+
+# file size unit conversion factors from bytes
+_UNIT_FACTORS = {
+    'bit': 8.0,
+    'kb': 1.0 / 2**10,
+    'mb': 1.0 / 2**20,
+    'gb': 1.0 / 2**30,
+    'tb': 1.0 / 2**40,
+    'pb': 1.0 / 2**50,
+}
+
+
+# files larger than this (in bytes) are read with pyarrow in Handler.read_from_csv
+_PYARROW_MIN_SIZE = 50 * 2**20
+
+
+# SLURM script headers for Handler.write_slurm_script
+_SLURM_TEMPLATE = '\n'.join([
+    '#!/bin/bash',
+    '#SBATCH --job-name={job_name}',
+    '#SBATCH --time={time}',
+    '#SBATCH --cpus-per-task={cpus}',
+    '#SBATCH --mem={mem}',
+    '#SBATCH --partition=all',
+    '#SBATCH --output=/scratch/rm885/support/out/slurm-jobs/slurm_%j.out',
+    'date',
+])
+_SLURM_TEMPLATE_ARRAY = '\n'.join([
+    '#!/bin/bash',
+    '#SBATCH --job-name={job_name}',
+    '#SBATCH --time={time}',
+    '#SBATCH --cpus-per-task={cpus}',
+    '#SBATCH --mem={mem}',
+    '#SBATCH --partition=all',
+    '#SBATCH --array=1-{iterations}',
+    '#SBATCH --output=/scratch/rm885/support/out/slurm-jobs/iter_%A_%a.out',
+    'date',
+])
+
+
+# reducers for Sublist.reduce; percentile_x is matched separately
+_REDUCERS = {
+    'mean': np.mean,
+    'median': np.median,
+    'std_dev': np.std,
+}
+_PCTL_RE = re.compile(r'^percentile_(\d+)$')
+
+
+# moving average expressions for small fixed kernel sizes on padded arrays
+_MA_FIXED = {
+    3: lambda a: (a[:-2] + a[1:-1] + a[2:]) / 3.0,
+    5: lambda a: (a[:-4] + a[1:-3] + a[2:-2] + a[3:-1] + a[4:]) / 5.0,
+    7: lambda a: (a[:-6] + a[1:-5] + a[2:-4] + a[3:-3] + a[4:-2] + a[5:-1] + a[6:]) / 7.0,
+}
+
+
 class Sublist(list):
     """
     Class to handle list operations
     """
+    _arr = None
+    _dtype = None
+    _pos = None
+
+    def _array(self):
+        """
+        Method to get the list as a numpy array; the array is cached until the list is modified.
+        The numeric dtype found on the first conversion is reused by later conversions
+        :return: numpy array
+        """
+        if self._arr is None or self._arr.shape[0] != len(self):
+            if self._dtype is not None:
+                try:
+                    self._arr = np.fromiter(self, dtype=self._dtype, count=len(self))
+                    return self._arr
+                except (OverflowError, TypeError, ValueError):
+                    self._dtype = None
+
+            self._arr = np.asarray(self)
+            if self._arr.dtype.kind in ('b', 'i', 'f'):
+                self._dtype = self._arr.dtype
+
+        return self._arr
+
+    def _numeric_array(self):
+        """
+        Method to get the cached numpy array only if the list is a flat list of numbers.
+        Other lists (mixed types, tuples, ragged elements) would be converted to str, 2d, or fail
+        :return: numpy array or None
+        """
+        try:
+            arr = self._array()
+        except ValueError:
+            return None
+
+        if arr.ndim == 1 and arr.dtype.kind in 'biuf':
+            return arr
+
+    def _reset(self,
+               elems=None):
+        """
+        Method to discard the cached numpy array after the list is modified
+        :param elems: Elements added to the list; the cached dtype is kept only if
+                      all of these are of the same kind (default: None, discard dtype)
+        """
+        self._arr = None
+        self._pos = None
+
+        if self._dtype is not None:
+            kind = self._dtype.kind
+            if elems is None or not all((type(elem) is bool) if kind == 'b' else
+                                        (type(elem) in (int, bool)) if kind == 'i' else
+                                        (type(elem) in (int, float, bool))
+                                        for elem in elems):
+                self._dtype = None
+
+    @staticmethod
+    def _indices(mask):
+        """
+        Method to convert a boolean mask to index or list of indices
+        :param mask: Boolean numpy array
+        :return: Index if only one element matches, otherwise list of indices
+        """
+        idx = np.flatnonzero(mask)
+
+        if idx.size == 1:
+            return int(idx[0])
+        else:
+            return idx.tolist()
+
+    def _compare(self,
+                 op,
+                 other):
+        """
+        Method to get the indices of the elements for which op(element, other) is true.
+        Numbers are compared with the cached array of a list of numbers; anything else, including
+        sequences such as lists that are compared as a whole, is compared with each element in turn
+        :param op: comparison operator function (e.g. operator.eq)
+        :param other: value to compare with
+        :return: Index if only one element matches, otherwise list of indices
+        """
+        if isinstance(other, (int, float, np.number)):
+            arr = self._numeric_array()
+            if arr is not None:
+                return self._indices(op(arr, other))
+
+        return self._indices(np.fromiter((bool(op(elem, other)) for elem in list.__iter__(self)),
+                                         dtype=bool,
+                                         count=len(self)))
+
     def __eq__(self,
                other):
         """
         Check for a = other
         return: List of indices
         """
-        temp = list(i for i in range(0, len(self)) if self[i] == other)
-
-        if len(temp) == 1:
-            return temp[0]
-        else:
-            return temp
+        return self._compare(operator.eq, other)
 
     def __gt__(self,
                other):
@@ -41,12 +249,7 @@ class Sublist(list):
         Check for a > other
         return: List of indices
         """
-        temp = list(i for i in range(0, len(self)) if self[i] > other)
-
-        if len(temp) == 1:
-            return temp[0]
-        else:
-            return temp
+        return self._compare(operator.gt, other)
 
     def __ge__(self,
                other):
@@ -54,12 +257,7 @@ class Sublist(list):
         Check for a >= other
         return: List of indices
         """
-        temp = list(i for i in range(0, len(self)) if self[i] >= other)
-
-        if len(temp) == 1:
-            return temp[0]
-        else:
-            return temp
+        return self._compare(operator.ge, other)
 
     def __lt__(self,
                other):
@@ -67,12 +265,7 @@ class Sublist(list):
         Check for a < other
         return: List of indices
         """
-        temp = list(i for i in range(0, len(self)) if self[i] < other)
-
-        if len(temp) == 1:
-            return temp[0]
-        else:
-            return temp
+        return self._compare(operator.lt, other)
 
     def __le__(self,
                other):
@@ -80,12 +273,7 @@ class Sublist(list):
         Check for a <= other
         return: List of indices
         """
-        temp = list(i for i in range(0, len(self)) if self[i] <= other)
-
-        if len(temp) == 1:
-            return temp[0]
-        else:
-            return temp
+        return self._compare(operator.le, other)
 
     def __ne__(self,
                other):
@@ -93,12 +281,7 @@ class Sublist(list):
         Check for a != other
         return: List of indices
         """
-        temp = list(i for i in range(0, len(self)) if self[i] != other)
-
-        if len(temp) == 1:
-            return temp[0]
-        else:
-            return temp
+        return self._compare(operator.ne, other)
 
     def __add__(self,
                 other):
@@ -119,13 +302,66 @@ class Sublist(list):
 
         try:
             if isinstance(item, list):
-                return list(list(self)[i] for i in item)
+                return list(super(Sublist, self).__getitem__(i) for i in item)
             else:
-                return list(self)[item]
+                return super(Sublist, self).__getitem__(item)
 
         except (TypeError, KeyError):
             print("List index not a number or list of numbers")
 
+    def __setitem__(self,
+                    key,
+                    value):
+        self._reset(None if isinstance(key, slice) else (value,))
+        super(Sublist, self).__setitem__(key, value)
+
+    def __delitem__(self,
+                    key):
+        self._reset()
+        super(Sublist, self).__delitem__(key)
+
+    def __iadd__(self,
+                 other):
+        other = list(other)
+        self._reset(other)
+        return super(Sublist, self).__iadd__(other)
+
+    def append(self,
+               elem):
+        self._reset((elem,))
+        super(Sublist, self).append(elem)
+
+    def extend(self,
+               elems):
+        elems = list(elems)
+        self._reset(elems)
+        super(Sublist, self).extend(elems)
+
+    def insert(self,
+               index,
+               elem):
+        self._reset((elem,))
+        super(Sublist, self).insert(index, elem)
+
+    def pop(self,
+            index=-1):
+        self._reset()
+        return super(Sublist, self).pop(index)
+
+    def sort(self,
+             **kwargs):
+        self._reset()
+        super(Sublist, self).sort(**kwargs)
+
+    def clear(self):
+        self._reset()
+        super(Sublist, self).clear()
+
+    def __imul__(self,
+                 other):
+        self._reset()
+        return super(Sublist, self).__imul__(other)
+
     def range(self,
               llim,
               ulim,
@@ -137,6 +373,15 @@ class Sublist(list):
         :param index: If the function should return index of values that lie within the limits
         :return: List
         """
+        arr = self._array()
+
+        if self._dtype is not None:
+            mask = (arr >= llim) & (arr <= ulim)
+            if index:
+                return np.flatnonzero(mask).tolist()
+            else:
+                return arr[mask].tolist()
+
         if index:
             return [i for i, x in enumerate(self) if llim <= x <= ulim]
         else:
@@ -164,9 +409,29 @@ class Sublist(list):
         :param elem: Index or list of indices
         :return: Sublist
         """
-        mask = np.zeros(len(self), dtype=bool) + True
-        mask[set(list(elem))] = False
-        return (np.array(self)[np.where(mask)]).tolist()
+        arr = self._array()
+        nelem = arr.shape[0]
+
+        try:
+            idx = np.unique(np.fromiter(elem, dtype=np.intp))
+        except TypeError:
+            idx = np.array([elem], dtype=np.intp)
+
+        if nelem > 2**16 and 0 < idx.shape[0] <= 128 and idx[0] >= 0 and idx[-1] < nelem:
+            # few indices in a long list: copy the segments between
+            # the indices instead of building a full length boolean mask
+            out_arr = np.empty(nelem - idx.shape[0], dtype=arr.dtype)
+            start = 0
+            pos = 0
+            for loc in idx.tolist():
+                out_arr[pos:pos + loc - start] = arr[start:loc]
+                pos += loc - start
+                start = loc + 1
+            out_arr[pos:] = arr[start:]
+
+            return out_arr.tolist()
+
+        return np.delete(arr, idx).tolist()
 
     def remove(self,
                elem):
@@ -175,12 +440,13 @@ class Sublist(list):
         :param elem: item or list
         :return: list
         """
+        arr = self._array()
+
         if type(elem).__name__ not in ('list', 'tuple', 'generator'):
-            return (np.array(self)[~np.in1d(np.array(self), np.array(elem))]).tolist()
+            return arr[arr != elem].tolist()
 
         else:
-            elem_ = list(set(list(elem)))
-            return (np.array(self)[~np.in1d(np.array(self), np.array(elem_))]).tolist()
+            return arr[~np.isin(arr, np.asarray(list(elem)))].tolist()
 
     @staticmethod
     def list_size(query_list):
@@ -204,7 +470,10 @@ class Sublist(list):
         """
         nelem = len(self)
         nelem_by_percent = int(round((float(nelem)*float(100 - percent))/float(100)))
-        return random.sample(self, nelem_by_percent)
+
+        # sample positions, so that the original elements are returned
+        return Sublist(list.__getitem__(self, i)
+                       for i in _RNG.choice(nelem, size=nelem_by_percent, replace=False).tolist())
 
     def random_selection(self,
                          num=1,
@@ -218,18 +487,17 @@ class Sublist(list):
         :return: Samples object
         """
 
-        arr = np.array(self)
-
         if num >= len(self):
             return self
 
         elif systematic:
             diff_seq = self.custom_list(0, len(self)-1, step=int(float(len(self))/float(num)))
-            temp = arr[np.array(diff_seq)]
-            return Sublist(temp)
+            return Sublist(list.__getitem__(self, i) for i in diff_seq)
 
         else:
-            return Sublist(np.random.choice(arr, size=num, replace=False))
+            # sample positions, so that the original elements are returned
+            return Sublist(list.__getitem__(self, i)
+                           for i in _RNG.choice(len(self), size=num, replace=False).tolist())
 
     def tuple_by_pairs(self):
         """
@@ -237,7 +505,7 @@ class Sublist(list):
         :return: List of tuples
         """
 
-        return Sublist((self[i], self[i+1]) for i in range(len(self) - 1))
+        return Sublist(zip(self, islice(self, 1, None)))
 
     @classmethod
     def custom_list(cls,
@@ -252,30 +520,22 @@ class Sublist(list):
         :return: list of integers
         """
 
-        # end of list
+        if step is None:
+            step = 1
+
+        # end of list: multiples of step up to end
         end = end + step - (end % step)
 
-        # initialize the list
-        out = Sublist()
-
-        # make iterator
-        if step is not None:
-            if start % step > 0:
-                out.append(start)
-                if start < step:
-                    start = step
-                elif start > step:
-                    start = start + step - (start % step)
-            iterator = range(start, end, step)
-        else:
-            step = 1
-            iterator = range(start, step, end)
+        # first multiple of step at or after start
+        first = start if start % step == 0 else start + step - (start % step)
+
+        out_arr = np.arange(first, end, step, dtype=np.int64)
 
-        # add the rest of the list to out
-        for i in iterator:
-            out.append(i)
+        # custom first number
+        if start % step > 0:
+            out_arr = np.concatenate([np.array([start], dtype=np.int64), out_arr])
 
-        return out
+        return Sublist(out_arr.tolist())
 
     def sublistfinder(self,
                       pattern):
@@ -284,25 +544,30 @@ class Sublist(list):
         :param pattern: shorter list
         :return: list of locations of elements in mylist ordered as in pattern
         """
-        return Sublist(self.index(x) if x in self else -1 for x in pattern)
+        if self._pos is None:
+            # first occurrence of each element wins, same as list.index
+            try:
+                self._pos = dict(zip(reversed(self), range(len(self) - 1, -1, -1)))
+            except TypeError:
+                return Sublist(self.index(x) if x in self else -1 for x in pattern)
+
+        return Sublist(self._pos.get(x, -1) for x in pattern)
 
     @staticmethod
     def hist(var_list,
              nbins=20,
              minmax=None):
 
+        var_list = np.asarray(var_list)
+
         if minmax is None:
-            minmax = (min(var_list), max(var_list))
+            minmax = (np.min(var_list), np.max(var_list))
 
-        bin_edges = Sublist.frange(minmax[0], minmax[1], div=nbins)
-        freq_list = list(0 for _ in range(len(bin_edges) - 1))
+        freq_list, bin_edges = np.histogram(var_list,
+                                            bins=nbins,
+                                            range=minmax)
 
-        for elem in var_list:
-            for ii in range(len(bin_edges) - 1):
-                if bin_edges[ii] <= elem < bin_edges[ii + 1]:
-                    freq_list[ii] += 1
-                  
-        return freq_list, bin_edges
+        return freq_list.tolist(), Sublist(bin_edges.tolist())
 
     @staticmethod
     def hist_equalize(list_dicts,
@@ -315,7 +580,9 @@ class Sublist(list):
         if var is None:
             raise ValueError('Variable not specified')
         else:
-            var_list = np.array(list(elem[var] for elem in list_dicts))
+            var_list = np.fromiter((elem[var] for elem in list_dicts),
+                                   dtype=np.float64,
+                                   count=len(list_dicts))
 
             if minmax is None:
                 minmax = (np.min(var_list),
@@ -350,7 +617,10 @@ class Sublist(list):
                 else:
                     out_indices = indices
 
-                out_list += list(list_dicts[jj] for jj in out_indices.tolist())
+                if out_indices.shape[0] == 1:
+                    out_list.append(list_dicts[out_indices[0]])
+                elif out_indices.shape[0] > 1:
+                    out_list.extend(operator.itemgetter(*out_indices.tolist())(list_dicts))
 
             return out_list
 
@@ -367,10 +637,45 @@ class Sublist(list):
         x2, y2 = pt2
         x3, y3 = pt3
 
-        _m_ = (x1 - x2) * (x1 - x3) * (x2 - x3)
-        a_param = (x3 * (y2 - y1) + x2 * (y1 - y3) + x1 * (y3 - y2)) / _m_
-        b_param = (x3 * x3 * (y1 - y2) + x2 * x2 * (y3 - y1) + x1 * x1 * (y2 - y3)) / _m_
-        c_param = (x2 * x3 * (x2 - x3) * y1 + x3 * x1 * (x3 - x1) * y2 + x1 * x2 * (x1 - x2) * y3) / _m_
+        return Sublist._parabola_param(x1, y1, x2, y2, x3, y3)
+
+    @staticmethod
+    def calc_parabola_param_batch(x1, y1, x2, y2, x3, y3):
+        """
+        define parabolas using three points each, for arrays of points
+        :param x1: Array of first point x
+        :param y1: Array of first point y
+        :param x2: Array of second point x
+        :param y2: Array of second point y
+        :param x3: Array of third point x
+        :param y3: Array of third point y
+        :return tuple of arrays of a, b, and c for parabolas a(x^2) + b*x + c = 0
+        """
+        return Sublist._parabola_param(np.asarray(x1, dtype=np.float64),
+                                       np.asarray(y1, dtype=np.float64),
+                                       np.asarray(x2, dtype=np.float64),
+                                       np.asarray(y2, dtype=np.float64),
+                                       np.asarray(x3, dtype=np.float64),
+                                       np.asarray(y3, dtype=np.float64))
+
+    @staticmethod
+    def _parabola_param(x1, y1, x2, y2, x3, y3):
+        """
+        parabola parameters from scalars or arrays of point coordinates
+        :return tuple of a, b, and c for parabola a(x^2) + b*x + c = 0
+        """
+        dx12 = x1 - x2
+        dx13 = x1 - x3
+        dx23 = x2 - x3
+
+        dy12 = y1 - y2
+        dy23 = y2 - y3
+        dy31 = y3 - y1
+
+        _m_ = dx12 * dx13 * dx23
+        a_param = -(x3 * dy12 + x2 * dy31 + x1 * dy23) / _m_
+        b_param = (x3 * x3 * dy12 + x2 * x2 * dy31 + x1 * x1 * dy23) / _m_
+        c_param = (x2 * x3 * dx23 * y1 - x3 * x1 * dx13 * y2 + x1 * x2 * dx12 * y3) / _m_
 
         return a_param, b_param, c_param
 
@@ -385,10 +690,13 @@ class Sublist(list):
         :param cascaded: If the smoothing should be cascaded from the specified moving average to the lowest(1)
         :return: smoothed array
         """
-        if type(arr) in (list, tuple, dict, set):
-            arr_copy = np.array(list(copy.deepcopy(arr)))
+        if type(arr) in (list, tuple):
+            arr_copy = np.array(arr)
+        elif type(arr) in (dict, set):
+            arr_copy = np.array(list(arr))
         elif type(arr) == np.ndarray:
-            arr_copy = arr.copy()
+            # input array is never written to, every pass below returns a new array
+            arr_copy = arr
         else:
             raise ValueError("Input array type not understood")
 
@@ -406,18 +714,40 @@ class Sublist(list):
                 raise ValueError('n cannot be an even number')
             ker_list = [n]
 
-        for ker_size in ker_list:
-            if ker_size > 1:
-                tail = int((ker_size - 1) / 2)
+        if not cascaded and (n in _MA_FIXED or njit is None):
+            tail = int((n - 1) / 2)
+            padded = np.concatenate([arr_copy[0:tail],
+                                     arr_copy,
+                                     arr_copy[-tail:]])
+
+            if n in _MA_FIXED:
+                arr_copy = _MA_FIXED[n](padded)
+            else:
+                arr_copy = sliding_window_view(padded, n).mean(axis=-1)
 
-                ret = np.cumsum(np.concatenate([arr_copy[0:tail],
-                                                arr_copy,
-                                                arr_copy[-tail:]]),
-                                dtype=np.float32)
+        elif njit is not None:
+            # ping-pong between two buffers, the kernel cannot work in place
+            arr_copy = arr_copy.astype(np.float64)
+            out = np.empty_like(arr_copy)
+
+            for ker_size in ker_list:
+                if ker_size > 1:
+                    _moving_average_kernel(arr_copy, ker_size, out)
+                    arr_copy, out = out, arr_copy
+
+        else:
+            for ker_size in ker_list:
+                if ker_size > 1:
+                    tail = int((ker_size - 1) / 2)
 
-                ret[ker_size:] = ret[ker_size:] - ret[:-ker_size]
+                    ret = np.cumsum(np.concatenate([arr_copy[0:tail],
+                                                    arr_copy,
+                                                    arr_copy[-tail:]]),
+                                    dtype=np.float32)
 
-                arr_copy = ret[ker_size - 1:] / ker_size
+                    ret[ker_size:] = ret[ker_size:] - ret[:-ker_size]
+
+                    arr_copy = ret[ker_size - 1:] / ker_size
 
         arr_copy = arr_copy.astype(dtype)
 
@@ -460,21 +790,21 @@ class Sublist(list):
             raise ValueError("Start and end value are the same!")
 
         if div is not None:
-            temp = Sublist(start + i * ((end-start)/float(div)) for i in range(0, div)) + [end]
+            temp = np.linspace(start, end, div + 1)
 
         elif step is not None:
-            if (end - start) % step == 0.0:
-                temp = Sublist(start + i * step for i in range(0, int((end - start) / step))) + [end]
-            else:
-                temp = Sublist(start + i * step for i in range(0, int((end - start) / step) + 1)) + [end]
+            nsteps = int((end - start) / step)
+            if (end - start) % step != 0.0:
+                nsteps += 1
+            temp = np.append(start + np.arange(nsteps) * step, end)
 
         else:
             raise ValueError("No step or division defined")
 
         if return_rev:
-            return Sublist(reversed(temp))
-        else:
-            return temp
+            temp = temp[::-1]
+
+        return Sublist(temp.tolist())
 
     def reverse(self):
         """reversed list"""
@@ -485,13 +815,19 @@ class Sublist(list):
         shuffle the list items
         :return: list
         """
-        x_ = self.copy()
-        np.random.shuffle(x_)
+        order = _RNG.permutation(len(self))
+        x_ = Sublist(list.__getitem__(self, i) for i in order.tolist())
+
+        # the shuffled array of a numeric list seeds the cache of the result
+        arr = self._numeric_array()
+        if arr is not None:
+            x_._arr = arr[order]
+            x_._dtype = self._dtype
         return x_
 
     def copy(self):
         """returns copied instance"""
-        return copy.deepcopy(self)
+        return Sublist(list.copy(self))
 
     @classmethod
     def column(cls,
@@ -524,7 +860,14 @@ class Sublist(list):
         calculate mean of an array
         :return: float
         """
-        return float(sum(self)) / max(len(self), 1)
+        nelem = len(self)
+
+        if nelem == 0:
+            raise ValueError('Cannot calculate mean of an empty list')
+        elif nelem > 1024:
+            return float(np.mean(self._array()))
+        else:
+            return math.fsum(self) / nelem
 
     def max(self):
         """
@@ -541,7 +884,7 @@ class Sublist(list):
         calculate median of an array
         :return: float
         """
-        return self.percentile(self, pctl=50)
+        return self.percentile(self._array(), pctl=50)
 
     @staticmethod
     def percentile(arr,
@@ -587,17 +930,15 @@ class Sublist(list):
                                                              here x is the percentile)
         :return: float
         """
-        if method == 'mean':
-            return np.mean(array)
-        elif method == 'median':
-            return np.median(array)
-        elif method == 'std_dev':
-            return np.std(array)
-        elif 'percentile' in method:
-            perc = int(method.split('_')[1])
-            return np.percentile(array, perc)
-        else:
-            raise ValueError("Invalid method type\nValid types: mean, median, std_dev, percentile_x")
+        reducer = _REDUCERS.get(method)
+        if reducer is not None:
+            return reducer(array)
+
+        pctl_match = _PCTL_RE.match(method)
+        if pctl_match is not None:
+            return np.percentile(array, int(pctl_match.group(1)))
+
+        raise ValueError("Invalid method type\nValid types: mean, median, std_dev, percentile_x")
 
 
 class Handler(object):
@@ -623,6 +964,26 @@ class Handler(object):
 
         self.sep = os.path.sep
 
+    @property
+    def _stem(self):
+        """
+        File name without the extension, from the current basename
+        :return: string
+        """
+        if self.basename is not None and '.' in self.basename:
+            return self.basename.rsplit('.', 1)[0]
+        return self.basename
+
+    @property
+    def _ext(self):
+        """
+        File name extension from the current basename (None if no extension)
+        :return: string
+        """
+        if self.basename is not None and '.' in self.basename:
+            return self.basename.rsplit('.', 1)[1]
+        return None
+
     def __repr__(self):
         if self.filename is not None:
             return '<Handler for {}>'.format(self.filename)
@@ -654,7 +1015,6 @@ class Handler(object):
                           This can be used in addition to the string
         :return:
         """
-        components = self.basename.split('.')
         if timestamp:
             timestamp = datetime.datetime.now().isoformat().replace('-', '').replace(':', '').split('.')[0]
         else:
@@ -665,11 +1025,10 @@ class Handler(object):
         else:
             string = timestamp
 
-        if len(components) >= 2:
-            return self.dirname + self.sep + '.'.join(components[0:-1]) + \
-                      string + '.' + str(components[-1])
+        if self._ext is not None:
+            return f'{self.dirname}{self.sep}{self._stem}{string}.{self._ext}'
         else:
-            return self.basename + self.sep + components[0] + string
+            return f'{self.basename}{self.sep}{self._stem}{string}'
 
     def file_rename_check(self):
         """
@@ -682,12 +1041,10 @@ class Handler(object):
         # if file exists then rename the input filename
         counter = 1
         while os.path.isfile(self.filename):
-            components = self.basename.split('.')
-            if len(components) < 2:
-                self.filename = self.dirname + os.path.sep + self.basename + '_' + str(counter)
+            if self._ext is None:
+                self.filename = f'{self.dirname}{self.sep}{self.basename}_{counter}'
             else:
-                self.filename = self.dirname + os.path.sep + ''.join(components[0:-1]) + \
-                           '_(' + str(counter) + ').' + components[-1]
+                self.filename = f'{self.dirname}{self.sep}{self._stem}_({counter}).{self._ext}'
             counter = counter + 1
         return self.filename
 
@@ -710,12 +1067,10 @@ class Handler(object):
             try:
                 os.remove(self.filename)
             except OSError:
-                components = self.basename.split('.')
-                if len(components) < 2:
-                    self.filename = self.dirname + os.path.sep + self.basename + '_' + str(counter)
+                if self._ext is None:
+                    self.filename = f'{self.dirname}{self.sep}{self.basename}_{counter}'
                 else:
-                    self.filename = self.dirname + os.path.sep + ''.join(components[0:-1]) + \
-                               '_(' + str(counter) + ').' + components[-1]
+                    self.filename = f'{self.dirname}{self.sep}{self._stem}_({counter}).{self._ext}'
                 # print('Unable to delete, using: ' + filename)
                 counter = counter + 1
         return self.filename
@@ -747,9 +1102,23 @@ class Handler(object):
         """
         Find number of lines or get text lines in a text or csv file
         :param nlines: If only the number of lines in a file should be returned
-        :param bufsize: size of buffer to be read
+        :param bufsize: size of buffer to be read (only used if the file cannot be memory mapped)
         :return: list or number
         """
+        try:
+            with open(self.filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if nlines:
+                        # count in 4 MB slices to avoid copying the whole file at once
+                        return sum(mm[i:i + 2**22].count(b'\n') for i in range(0, len(mm), 2**22))
+                    else:
+                        text = mm[:].decode().replace('\r\n', '\n').replace('\r', '\n')
+                        return text.split('\n')[:-1]
+
+        except (ValueError, OSError):
+            # empty files and non-regular files cannot be memory mapped
+            pass
+
         with open(self.filename, 'r') as f:
             bufgen = takewhile(lambda x: x, (f.read(bufsize) for _ in repeat(None)))
 
@@ -801,20 +1170,15 @@ class Handler(object):
                           (ignored if array_1d flag is false)
         :returns: Numpy array (2d or 1d)
         """
-        with open(self.filename) as f:
-            content = f.readlines()
-            lines = [x.strip() for x in content]
-            ncols = len(lines[0].split(delim))
-            nrows = len(lines)
-            arr = np.zeros((nrows, ncols))
-            for i, line in enumerate(lines):
-                arr[i:] = [float(elem.strip()) for elem in line.split(delim)]
+        arr = np.loadtxt(self.filename,
+                         delimiter=delim,
+                         dtype=np.float64,
+                         ndmin=2)
 
         if array_1d:
-            lenr, lenc = arr.shape
-            arr_out = arr.reshape(lenr * lenc)
+            arr_out = arr.ravel()
             if nodataval is not None:
-                arr_out = arr_out[arr_out != nodataval]
+                arr_out = arr_out[np.not_equal(arr_out, nodataval)]
             return arr_out
         else:
             return arr
@@ -847,10 +1211,8 @@ class Handler(object):
         if self.filename.endswith(".gz"):
             Opt.cprint('Extracting {} to {}'.format(self.basename,
                                                     temp.basename))
-            with gzip.open(self.filename, 'rb') as gf:
-                file_content = gf.read()
-                with open(tempfile, 'wb') as fw:
-                    fw.write(file_content)
+            with gzip.open(self.filename, 'rb') as gf, open(tempfile, 'wb') as fw:
+                shutil.copyfileobj(gf, fw, 1 << 20)
 
         else:  # not a tar.gz archive
             raise TypeError("Not a .gz archive")
@@ -868,22 +1230,8 @@ class Handler(object):
         """
         size = os.path.getsize(self.filename)
 
-        getcontext().prec = precision
-
-        if unit == 'bit':
-            output = float(Decimal(size)*Decimal(2**3))
-        elif unit == 'kb':
-            output = float(Decimal(size)/Decimal(2**10))
-        elif unit == 'mb':
-            output = float(Decimal(size)/(Decimal(2**20)))
-        elif unit == 'gb':
-            output = float(Decimal(size)/(Decimal(2**30)))
-        elif unit == 'tb':
-            output = float(Decimal(size)/(Decimal(2**40)))
-        elif unit == 'pb':
-            output = float(Decimal(size)/(Decimal(2**50)))
-        else:
-            output = size
+        output = size * _UNIT_FACTORS.get(unit, 1)
+
         if as_long:
             return int(round(output, precision))
         else:
@@ -962,49 +1310,15 @@ class Handler(object):
         :param kwargs: key word arguments
         :return:
         """
-        script_dict = {
-            'bash': '#!/bin/bash',
-            'job-name': '#SBATCH --job-name=' + job_name,
-            'time': '#SBATCH --time=' + str(datetime.timedelta(minutes=time_in_mins)),
-            'cpus': '#SBATCH --cpus-per-task=' + str(cpus),
-            'ntasks': '#SBATCH --ntasks=' + str(ntasks),
-            'mem': '#SBATCH --mem=' + str(mem),
-            'partition': '#SBATCH --partition=all',
-            'array_def': '#SBATCH --array=1-' + str(iterations),
-            'array_out': '#SBATCH --output=/scratch/rm885/support/out/slurm-jobs/iter_%A_%a.out',
-            'out': '#SBATCH --output=/scratch/rm885/support/out/slurm-jobs/slurm_%j.out',
-            'date': 'date',
-            'array_echo': 'echo "Job ID is"$SLURM_ARRAY_TASK_ID'
-        }
-        if array:
-            script_list = [
-                script_dict['bash'],
-                script_dict['job-name'],
-                script_dict['time'],
-                script_dict['cpus'],
-                script_dict['mem'],
-                script_dict['partition'],
-                script_dict['array_def'],
-                script_dict['array_out'],
-                script_dict['date'],
-            ]
-            for key, value in kwargs.items():
-                script_list.append(value)
-            script_list.append(script_dict['date'])
-        else:
-            script_list = [
-                script_dict['bash'],
-                script_dict['job-name'],
-                script_dict['time'],
-                script_dict['cpus'],
-                script_dict['mem'],
-                script_dict['partition'],
-                script_dict['out'],
-                script_dict['date'],
-            ]
-            for key, value in kwargs.items():
-                script_list.append(value)
-            script_list.append(script_dict['date'])
+        template = _SLURM_TEMPLATE_ARRAY if array else _SLURM_TEMPLATE
+
+        script_list = [template.format(job_name=job_name,
+                                       time=datetime.timedelta(minutes=time_in_mins),
+                                       cpus=cpus,
+                                       mem=mem,
+                                       iterations=iterations)]
+        script_list += list(kwargs.values())
+        script_list.append('date')
 
         self.write_list_to_file(script_list)
 
@@ -1028,21 +1342,26 @@ class Handler(object):
         if len(np_array.shape) == 1:
             np_array = np_array[:, np.newaxis]
 
-        if rownames is not None:
-            np_array = np.hstack(np.array(rownames)[:, np.newaxis], np_array)
-            if header is not None:
-                header = delim + header
-
-        np_list = []
-        np_list += np_array.tolist()
-        np_list = list(delim.join(list(str(elem) for elem in row_list))
-                       for row_list in np_list)
+        if rownames is None:
+            np.savetxt(self.filename,
+                       np_array,
+                       fmt='%s',
+                       delimiter=delim,
+                       header='' if header is None else header,
+                       comments='')
+            return
+
+        np_array = np.hstack((np.array(rownames, dtype=object)[:, np.newaxis],
+                              np_array.astype(object)))
         if header is not None:
-            np_list = [header] + np_list
+            header = delim + header
 
-        with open(self.filename, 'w') as fileptr:
-            for line in np_list:
-                fileptr.write('{}\n'.format(str(line)))
+        row_fmt = delim.join(['%s'] * np_array.shape[1]) + '\n'
+
+        with open(self.filename, 'wb') as fileptr:
+            if header is not None:
+                fileptr.write((header + '\n').encode())
+            fileptr.writelines((row_fmt % tuple(row)).encode() for row in np_array.tolist())
 
     def read_from_csv(self,
                       return_dicts=False,
@@ -1063,104 +1382,125 @@ class Handler(object):
         :returns: dictionary of data
         """
         lines = list()
-        index_list = list()
 
-        n_lines = self.file_lines(nlines=True)
-        if verbose:
-            sys.stdout.write('Lines in file: {}\n'.format(str(n_lines)))
+        if read_random and 0.0 < percent_random <= 100.0:
+            # read only the header and the selected lines
+            source = io.BytesIO(self._sample_lines(percent_random,
+                                                   line_limit=line_limit,
+                                                   systematic=systematic,
+                                                   verbose=verbose))
+            line_limit = None
+        else:
+            source = self.filename
 
-        if read_random:
-            if 0.0 < percent_random <= 100.0:
-                if verbose:
-                    sys.stdout.write('Randomizing index ... \n')
-                n_rand_lines = int((float(percent_random) / 100.0) * float(n_lines))
-                index_list = sorted([0] + Sublist(range(1, n_lines)).random_selection(num=n_rand_lines,
-                                                                                      systematic=systematic))
         if verbose:
             sys.stdout.write('Reading file : ')
 
-        counter = 0
-        perc_ = 0
-        with open(self.filename, 'r') as f:
-            if line_limit:
-                if len(index_list) > 0:
-                    if 0 < len(index_list) <= line_limit:
-                        pass
-                    elif len(index_list) > line_limit:
-                        index_list = index_list[:(line_limit + 1)]
-
-                    for i, line in enumerate(f):
-                        if counter > line_limit:
-                            break
-                        if i == index_list[counter]:
-                            lines.append(list(elem.strip() for elem in line.split(',')))
-                            counter += 1
-
-                            if counter > int((float(perc_) / 100.0) * float(len(index_list))):
-                                if verbose:
-                                    sys.stdout.write('{}..'.format(str(perc_)))
-                                perc_ += 10
-                    if verbose:
-                        sys.stdout.write('!\n')
+        if pacsv is not None and source is self.filename and not line_limit \
+                and os.path.getsize(self.filename) > _PYARROW_MIN_SIZE and self._regular_csv(self.filename):
+            # header parsed on its own, so that all columns can be read as strings
+            with open(self.filename, 'rb') as fileptr:
+                header = pacsv.read_csv(io.BytesIO(fileptr.readline())).column_names
 
-                else:
-                    for line in f:
-                        if counter > line_limit:
-                            break
-                        lines.append(list(elem.strip() for elem in line.split(',')))
-                        counter += 1
-
-                        if counter > int((float(perc_) / 100.0) * float(line_limit)):
-                            if verbose:
-                                sys.stdout.write('{}..'.format(str(perc_)))
-                            perc_ += 10
-                    if verbose:
-                        sys.stdout.write('!\n')
+            # multi-threaded read for large files, values converted like the lines read below
+            table = pacsv.read_csv(self.filename,
+                                   read_options=pacsv.ReadOptions(use_threads=True,
+                                                                  block_size=8 << 20),
+                                   convert_options=pacsv.ConvertOptions(column_types=dict((name, pa.string())
+                                                                                          for name in header),
+                                                                        strings_can_be_null=False))
+
+            names = list(str(elem).strip() for elem in table.column_names)
+            columns = list(self.column_to_type(pc.utf8_trim_whitespace(column).to_pylist())
+                           for column in table.columns)
+
+            if verbose:
+                sys.stdout.write('!\n')
 
+            if return_dicts:
+                if verbose:
+                    sys.stdout.write('Converting to Dictionaries...\n')
+                return list(dict(zip(names, feat)) for feat in zip(*columns))
             else:
-                if len(index_list) > 0:
+                return {
+                    'feature': list(list(feat) for feat in zip(*columns)),
+                    'name': names,
+                }
 
-                    for i, line in enumerate(f):
-                        if counter >= len(index_list):
-                            break
+        if pd is not None and self._regular_csv(source):
+            # values read as strings and converted like the lines read below.
+            # The header is read as a row, so that column names are not changed by pandas
+            dataframe = pd.read_csv(source,
+                                    header=None,
+                                    nrows=(line_limit + 1) if line_limit else None,
+                                    dtype=str,
+                                    keep_default_na=False,
+                                    na_filter=False,
+                                    skipinitialspace=True)
 
-                        if index_list[counter] == i:
-                            lines.append(list(elem.strip() for elem in line.split(',')))
-                            counter += 1
+            names = list(sys.intern(str(elem).strip()) for elem in dataframe.iloc[0].tolist())
+            columns = list(self.column_to_type(list(elem.strip() for elem in dataframe[col].tolist()[1:]))
+                           for col in dataframe.columns)
 
-                            if counter > int((float(perc_) / 100.0) * float(len(index_list))):
-                                if verbose:
-                                    sys.stdout.write('{}..'.format(str(perc_)))
-                                perc_ += 10
-                    if verbose:
-                        sys.stdout.write('!\n')
+            if verbose:
+                sys.stdout.write('!\n')
 
-                else:
-                    for line in f:
-                        lines.append(list(elem.strip() for elem in line.split(',')))
-                        counter += 1
+            if return_dicts:
+                if verbose:
+                    sys.stdout.write('Converting to Dictionaries...\n')
+                return list(dict(zip(names, feat)) for feat in zip(*columns))
+            else:
+                return {
+                    'feature': list(list(feat) for feat in zip(*columns)),
+                    'name': names,
+                }
 
-                        if counter > int((float(perc_) / 100.0) * float(n_lines)):
-                            if verbose:
-                                sys.stdout.write('{}..'.format(str(perc_)))
-                            perc_ += 10
-                    if verbose:
-                        sys.stdout.write('!\n')
+        if source is not self.filename:
+            lines = list(list(elem.strip() for elem in line.split(','))
+                         for line in source.getvalue().decode().splitlines())
+            if verbose:
+                sys.stdout.write('!\n')
 
-        # convert col names to list of strings
-        names = list(elem.strip() for elem in lines[0])
+        else:
+            # progress is tracked by lines read if limited, else by characters read
+            if line_limit:
+                total = float(line_limit)
+            else:
+                total = float(os.path.getsize(self.filename))
+
+            counter = 0
+            read_size = 0
+            perc_ = 0
+            with open(self.filename, 'r') as f:
+                for line in f:
+                    if line_limit and counter > line_limit:
+                        break
+                    lines.append(list(elem.strip() for elem in line.split(',')))
+                    counter += 1
+                    read_size += len(line)
+
+                    if (counter if line_limit else read_size) > int((float(perc_) / 100.0) * total):
+                        if verbose:
+                            sys.stdout.write('{}..'.format(str(perc_)))
+                        perc_ += 10
+                if verbose:
+                    sys.stdout.write('!\n')
+                    Opt.flush()
 
         if len(lines) > 0:
+            # convert col names to list of interned strings
+            names = list(sys.intern(elem.strip()) for elem in lines[0])
+
+            features = self.strings_to_types(lines[1:])
+
             # convert to list
             if return_dicts:
                 if verbose:
                     sys.stdout.write('Converting to Dictionaries...\n')
-                return list(dict(zip(names, list(self.string_to_type(elem) for elem in feat)))
-                            for feat in lines[1:])
+                return list(dict(zip(names, feat)) for feat in features)
             else:
                 return {
-                    'feature': list(list(self.string_to_type(elem) for elem in feat)
-                                    for feat in lines[1:]),
+                    'feature': features,
                     'name': names,
                 }
         else:
@@ -1169,6 +1509,165 @@ class Handler(object):
                 'name': list(),
             }
 
+    def iter_from_csv(self,
+                      chunksize=50000,
+                      return_dicts=False):
+        """
+        Read csv with header in chunks of rows, so only one chunk is held in memory at a time.
+        Values are typed per chunk, in the same way as in read_from_csv.
+        :param chunksize: Number of rows in each chunk (default: 50000)
+        :param return_dicts: If lists of dictionaries should be yielded (default: False)
+        :returns: generator of dictionaries of data (as in read_from_csv) or lists of dictionaries
+        """
+        if pd is not None and self._regular_csv(self.filename):
+            # values read as strings and converted like the lines read below
+            with open(self.filename, 'r') as f:
+                names = list(sys.intern(elem.strip()) for elem in f.readline().split(','))
+
+            try:
+                reader = pd.read_csv(self.filename,
+                                     header=None,
+                                     skiprows=1,
+                                     chunksize=chunksize,
+                                     dtype=str,
+                                     keep_default_na=False,
+                                     na_filter=False,
+                                     skipinitialspace=True)
+            except pd.errors.EmptyDataError:
+                # header only
+                return
+
+            with reader:
+                for dataframe in reader:
+                    columns = list(self.column_to_type(list(elem.strip() for elem in dataframe[col].tolist()))
+                                   for col in dataframe.columns)
+                    features = list(list(feat) for feat in zip(*columns))
+
+                    if return_dicts:
+                        yield list(dict(zip(names, feat)) for feat in features)
+                    else:
+                        yield {
+                            'feature': features,
+                            'name': names,
+                        }
+            return
+
+        with open(self.filename, 'r') as f:
+            names = list(sys.intern(elem.strip()) for elem in f.readline().split(','))
+
+            while True:
+                lines = list(list(elem.strip() for elem in line.split(','))
+                             for line in islice(f, chunksize))
+                if len(lines) == 0:
+                    break
+
+                features = self.strings_to_types(lines)
+
+                if return_dicts:
+                    yield list(dict(zip(names, feat)) for feat in features)
+                else:
+                    yield {
+                        'feature': features,
+                        'name': names,
+                    }
+
+    @staticmethod
+    def _regular_csv(source):
+        """
+        Method to check if all lines of a csv file have the same number of fields, without blank lines or quotes.
+        Only then does a bulk csv reader return the same rows as splitting each line on commas
+        :param source: File name or io.BytesIO object
+        :return: bool
+        """
+        if isinstance(source, io.BytesIO):
+            return Handler._regular_csv_bytes(source.getvalue())
+
+        if os.path.getsize(source) == 0:
+            return False
+
+        with open(source, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return Handler._regular_csv_bytes(mm)
+
+    @staticmethod
+    def _regular_csv_bytes(data):
+        """
+        Method to check the lines of csv bytes, see Handler._regular_csv
+        :param data: bytes-like object
+        :return: bool
+        """
+        file_bytes = np.frombuffer(data, dtype=np.uint8)
+        if file_bytes.size == 0 or (file_bytes == ord('"')).any():
+            return False
+
+        # line end offsets, and the end of a last line without a newline
+        line_ends = np.flatnonzero(file_bytes == ord('\n'))
+        if line_ends.size == 0 or line_ends[-1] != file_bytes.size - 1:
+            line_ends = np.append(line_ends, file_bytes.size)
+        line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+
+        # commas in each line, from the comma offsets
+        commas = np.flatnonzero(file_bytes == ord(','))
+        ncommas = np.searchsorted(commas, line_ends) - np.searchsorted(commas, line_starts)
+        if (ncommas != ncommas[0]).any():
+            return False
+
+        line_lengths = line_ends - line_starts
+        blank = (line_lengths == 0) | \
+            ((line_lengths == 1) & (file_bytes[np.minimum(line_starts, file_bytes.size - 1)] == ord('\r')))
+
+        return not blank.any()
+
+    def _sample_lines(self,
+                      percent_random,
+                      line_limit=None,
+                      systematic=False,
+                      verbose=False):
+        """
+        Method to read the header and a random selection of lines of a text file
+        using a memory map of the file
+        :param percent_random: What percentage of lines should be randomly selected
+        :param line_limit: Limits on the number of selected lines (default: None)
+        :param systematic: If the samples should be systematic instead of random
+        :param verbose: Display steps
+        :returns: bytes of the selected lines
+        """
+        # empty files cannot be memory mapped
+        if os.path.getsize(self.filename) == 0:
+            return b''
+
+        with open(self.filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # line end offsets in a single vectorized pass
+                file_bytes = np.frombuffer(mm, dtype=np.uint8)
+                line_ends = np.flatnonzero(file_bytes == ord('\n'))
+                del file_bytes
+
+                n_lines = line_ends.shape[0]
+                if n_lines == 0:
+                    return mm[:]
+
+                if verbose:
+                    sys.stdout.write('Lines in file: {}\n'.format(str(n_lines)))
+                    sys.stdout.write('Randomizing index ... \n')
+
+                n_rand_lines = int((float(percent_random) / 100.0) * float(n_lines))
+
+                # bitmap of selected lines, header included
+                line_mask = np.zeros(n_lines, dtype=np.bool_)
+                line_mask[0] = True
+                line_mask[Sublist(range(1, n_lines)).random_selection(num=n_rand_lines,
+                                                                      systematic=systematic)] = True
+
+                selected = np.flatnonzero(line_mask)
+                if line_limit:
+                    selected = selected[:(line_limit + 1)]
+
+                line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+
+                return b''.join(mm[start:end + 1] for start, end in zip(line_starts[selected].tolist(),
+                                                                        line_ends[selected].tolist()))
+
     @staticmethod
     def write_to_csv(list_of_dicts,
                      outfile=None,
@@ -1182,20 +1681,12 @@ class Handler(object):
         if type(list_of_dicts).__name__ not in ('tuple', 'list'):
             list_of_dicts = [list_of_dicts]
 
-        lines = list()
+        body = '\n'.join(delimiter.join(map(str, data_dict.values())) for data_dict in list_of_dicts)
         if header:
-            lines.append(delimiter.join(list(list_of_dicts[0])))
-        for data_dict in list_of_dicts:
-            lines.append(delimiter.join(list(str(val) for _, val in data_dict.items())))
+            body = delimiter.join(list_of_dicts[0]) + '\n' + body
 
-        if append:
-            with open(outfile, 'a') as f:
-                for line in lines:
-                    f.write(line + '\n')
-        else:
-            with open(outfile, 'w') as f:
-                for line in lines:
-                    f.write(line + '\n')
+        with open(outfile, 'a' if append else 'w') as f:
+            f.write(body + '\n')
 
     def find_all(self,
                  pattern='*',
@@ -1217,24 +1708,32 @@ class Handler(object):
         if self.dirname[-1] != self.sep:
             self.dirname += self.sep
 
-        for root, dirs, files in os.walk(self.dirname):
-            if find_dirs:
-                for dirname in dirs:
-                    if verbose:
-                        Opt.cprint(os.path.join(root, dirname))
+        matcher = re.compile(fnmatch.translate(search_str)).match
 
-                    if fnmatch.fnmatch(dirname, search_str):
-                        if str(root) in str(self.dirname) or str(self.dirname) in str(root):
-                            result.append(os.path.join(root, dirname))
+        # top-down walk of the folder tree, symbolic links to folders are not followed
+        stack = [self.dirname]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
 
-            else:
-                for name in files:
-                    if verbose:
-                        Opt.cprint(os.path.join(root, name))
+            with entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                        if is_dir and not entry.is_symlink():
+                            stack.append(entry.path)
+                    except OSError:
+                        is_dir = False
+
+                    if is_dir == find_dirs:
+                        if verbose:
+                            Opt.cprint(entry.path)
+
+                        if matcher(entry.name):
+                            result.append(entry.path)
 
-                    if fnmatch.fnmatch(name, search_str):
-                        if str(root) in str(self.dirname) or str(self.dirname) in str(root):
-                            result.append(os.path.join(root, name))
         if verbose:
             Opt.cprint('======================\nFound {} results for {} in {}:'.format(str(len(result)),
                                                                                        pattern,
@@ -1242,13 +1741,60 @@ class Handler(object):
             for filename in result:
                 Opt.cprint(filename)
             Opt.cprint('======================')
+            Opt.flush()
         return result  # list
 
     def find_files(self,
                    pattern='*'):
-        return list(f_ for f_ in list(f for f in os.listdir(self.dirname)
-                                      if os.path.isfile(os.path.join(self.dirname, f)))
-                    if pattern in f_)
+        return list(f for f in os.listdir(self.dirname)
+                    if pattern in f and os.path.isfile(os.path.join(self.dirname, f)))
+
+    @staticmethod
+    def strings_to_types(rows):
+        """
+        Method to convert a list of rows of strings to int, float, or str values.
+        Each column is converted at once if all its values are of the same type,
+        otherwise the column values are converted one by one.
+        :param rows: list of lists of strings
+        :return: list of lists
+        """
+        if len(rows) == 0 or any(len(row) != len(rows[0]) for row in rows):
+            return list(list(Handler.string_to_type(elem) for elem in row) for row in rows)
+
+        columns = list(Handler.column_to_type(column) for column in zip(*rows))
+
+        return list(list(row) for row in zip(*columns))
+
+    @staticmethod
+    def column_to_type(column):
+        """
+        Method to convert a column of strings to int, float, or str values, as Handler.string_to_type does.
+        The column is converted at once if all its values are ints that fit in int64, or all are floats
+        that are not ints, otherwise the values are converted one by one.
+        :param column: list or tuple of strings
+        :return: list
+        """
+        col_arr = np.array(column)
+        try:
+            return col_arr.astype(np.int64).tolist()
+        except OverflowError:
+            return list(Handler.string_to_type(elem) for elem in column)
+        except ValueError:
+            pass
+
+        try:
+            values = col_arr.astype(np.float64)
+        except (ValueError, OverflowError):
+            return list(Handler.string_to_type(elem) for elem in column)
+
+        # whole numbers written without a decimal point or exponent are ints in string_to_type
+        whole = col_arr[np.isfinite(values) & (values == np.floor(values))]
+        if whole.size > 0:
+            float_notation = (np.char.find(whole, '.') >= 0) | (np.char.find(np.char.lower(whole), 'e') >= 0)
+            if not float_notation.all():
+                return list(Handler.string_to_type(elem) for elem in column)
+
+        return values.tolist()
 
     @staticmethod
     def string_to_type(x):
@@ -1290,26 +1836,18 @@ class Opt:
         Function to print memory usage of the python process
         :return print to console/output
         """
-        process = psutil.Process(os.getpid())
-        mem = process.memory_info().rss
-
-        if 2**10 <= mem < 2**20:
-            div = float(2**10)
-            suff = ' KB'
-        elif 2**20 <= mem < 2**30:
-            div = float(2**20)
-            suff = ' MB'
-        elif 2**30 <= mem < 2**40:
-            div = float(2**30)
-            suff = ' GB'
-        elif mem >= 2**40:
-            div = float(2**40)
-            suff = ' TB'
-        else:
-            div = 1.0
-            suff = ' BYTES'
+        try:
+            # resident set size in pages, linux only
+            with open('/proc/self/statm') as statm:
+                mem = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            import psutil
+            mem = psutil.Process(os.getpid()).memory_info().rss
 
-        print_str = 'MEMORY USAGE: {:{w}.{p}f}'.format(process.memory_info().rss / div, w=5, p=2) + suff
+        exponent = min(int(math.log2(mem)) // 10, 4) if mem > 0 else 0
+        suff = (' BYTES', ' KB', ' MB', ' GB', ' TB')[exponent]
+
+        print_str = 'MEMORY USAGE: {:{w}.{p}f}'.format(mem / float(2**(10 * exponent)), w=5, p=2) + suff
 
         Opt.cprint(print_str)
 
@@ -1325,6 +1863,12 @@ class Opt:
     def cprint(text,
                newline='\n'):
         sys.stdout.write(str(text) + newline)
+
+    @staticmethod
+    def flush():
+        """
+        Flush text written to console/output
+        """
         sys.stdout.flush()
 
     @staticmethod
@@ -1367,6 +1911,11 @@ class FTPHandler(Handler):
 
     def connect(self):
         """Handle for ftp connections"""
+        # get ftp connection object
+        self.conn = self._login()
+
+    def _login(self):
+        """Open and login to a new ftp connection"""
         # define ftp
         ftp = ftplib.FTP(self.ftpserv)
 
@@ -1379,42 +1928,83 @@ class FTPHandler(Handler):
         else:
             ftp.login()
 
-        # get ftp connection object
-        self.conn = ftp
+        return ftp
 
     def disconnect(self):
         """close connection"""
         self.conn.close()
 
-    def getfiles(self):
-        """Copy all files from FTP that are in a list"""
+    def getfiles(self,
+                 max_workers=8):
+        """
+        Copy all files from FTP that are in a list
+        :param max_workers: Maximum number of parallel ftp connections for a list of files (default: 8)
+        """
 
         # connection
         ftp_conn = self.conn
 
         # get file(s) and write to disk
         if isinstance(self.ftpfilepath, list):
-            filenamelist = [self.dirname + self.sep + Handler(ftpfile).basename
-                            for ftpfile in self.ftpfilepath]
+            nworkers = min(max_workers, len(self.ftpfilepath))
 
-            for i in range(0, len(filenamelist)):
-                self.filename = filenamelist[i]
-                with open(self.filename, 'wb') as f:
-                    try:
-                        if ftp_conn.retrbinary("RETR {}".format(self.ftpfilepath[i]), f.write):
-                            print('Copying file {} to {}'.format(self.basename,
-                                                                 self.dirname))
+            if nworkers > 1:
+                # each worker downloads every nworkers-th file over its own connection
+                with ThreadPoolExecutor(max_workers=nworkers) as executor:
+                    list(executor.map(self._download,
+                                      list(self.ftpfilepath[i::nworkers] for i in range(nworkers))))
+            else:
+                for ftpfile in self.ftpfilepath:
+                    self._retrieve(ftp_conn, ftpfile, self.dirname + self.sep + Handler(ftpfile).basename)
 
-                    except Exception as err:
-                        Opt.cprint('File {} not found or already written\n Error: {}'.format(self.basename,
-                                                                                             err))
+            if len(self.ftpfilepath) > 0:
+                self.filename = self.dirname + self.sep + Handler(self.ftpfilepath[-1]).basename
         else:
-            self.filename = self.dirname + Handler().sep + Handler(self.ftpfilepath).basename
-            with open(self.filename, 'wb') as f:
-                try:
-                    if ftp_conn.retrbinary("RETR {}".format(self.ftpfilepath), f.write):
-                        Opt.cprint('Copying file {} to {}'.format(Handler(self.ftpfilepath).basename,
-                                                             self.dirname))
-                except Exception:
-                    Opt.cprint('File {} not found or already written'.format(self.basename))
+            self.filename = self.dirname + self.sep + Handler(self.ftpfilepath).basename
+            self._retrieve(ftp_conn, self.ftpfilepath, self.filename)
 
+    def _download(self,
+                  ftpfiles):
+        """
+        Copy a list of files from FTP to disk over a new connection
+        :param ftpfiles: List of paths of the files on the FTP server
+        """
+        ftp_conn = self._login()
+        try:
+            for ftpfile in ftpfiles:
+                self._retrieve(ftp_conn, ftpfile, self.dirname + self.sep + Handler(ftpfile).basename)
+        finally:
+            ftp_conn.close()
+
+    def _retrieve(self,
+                  ftp_conn,
+                  ftpfile,
+                  filename,
+                  blocksize=1 << 20):
+        """
+        Copy one file from FTP to disk
+        :param ftp_conn: FTP connection object
+        :param ftpfile: Path of the file on the FTP server
+        :param filename: Local file path to write to
+        :param blocksize: Size of blocks to be read (default: 1 MB)
+        """
+        ftp_basename = Handler(ftpfile).basename
+
+        with open(filename, 'wb') as f:
+            # allocate the file on disk in one call if the size is known
+            try:
+                size = ftp_conn.size(ftpfile)
+                if size and hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(f.fileno(), 0, size)
+            except ftplib.all_errors:
+                pass
+
+            try:
+                if ftp_conn.retrbinary("RETR {}".format(ftpfile), f.write, blocksize=blocksize):
+                    Opt.cprint('Copying file {} to {}'.format(ftp_basename,
+                                                              self.dirname))
+            except Exception as err:
+                Opt.cprint('File {} not found or already written\n Error: {}'.format(ftp_basename,
+                                                                                     err))
+            # drop any preallocated space that was not written
+            f.truncate()
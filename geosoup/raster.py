@@ -1,15 +1,522 @@
 import numpy as np
 from geosoup.common import Handler, Opt
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
 import warnings
+import tempfile
+import re
+import os
 from osgeo import gdal, gdal_array, ogr, osr, gdalconst
 np.set_printoptions(suppress=True)
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+try:
+    import shapely
+    if not hasattr(shapely, 'from_wkb'):  # vectorized functions need shapely 2
+        shapely = None
+except ImportError:
+    shapely = None
+
 # Tell GDAL to throw Python exceptions, and register all drivers
 gdal.UseExceptions()
 gdal.AllRegister()
 
+# drivers used repeatedly
+_GTIFF_DRIVER = gdal.GetDriverByName('GTiff')
+_MEM_DRIVER = gdal.GetDriverByName('MEM')
+
+
+__all__ = ['Raster', 'MultiRaster', 'set_gdal_perf_options']
+
+
+# largest number of pixels (bands x rows x cols) read into memory at once
+MAX_PIXELS = int(float(os.environ.get('GEOSOUP_MAX_PIXELS', 1e9)))
+
+# GTiff creation options used by Raster.write_to_file unless given by the user
+_GTIFF_CREATION_OPTIONS = {'TILED': 'YES',
+                           'BLOCKXSIZE': '256',
+                           'BLOCKYSIZE': '256',
+                           'COMPRESS': 'DEFLATE',
+                           'ZLEVEL': '6',
+                           'NUM_THREADS': 'ALL_CPUS',
+                           'BIGTIFF': 'IF_SAFER'}
+
+
+# reducers of the pixel values and coordinates extracted for each geometry
+_GEOM_REDUCERS = {'mean': np.mean,
+                  'median': np.median,
+                  'min': np.min,
+                  'max': np.max}
+_PCTL_RE = re.compile(r'^percentile_(\d+)$')
+
+
+# footprints with more vertices are simplified before intersecting them
+_MAX_FOOTPRINT_VERTICES = 64
+
+# smallest number of pixels in a tile sized by _cache_tile_size, as each tile has a fixed read overhead
+_MIN_TILE_PIXELS = 512 * 512
+
+# number of BuildVRTOptions objects kept by MultiRaster.layerstack
+_MAX_VRT_OPTIONS = 32
+
+# reducers of MultiRaster.composite along the layer axis, ignoring NaN
+_COMPOSITE_REDUCERS = {'mean': np.nanmean,
+                       'median': np.nanmedian,
+                       'min': np.nanmin,
+                       'max': np.nanmax}
+
+# operation code and percentile of the compiled composite kernel
+_COMPOSITE_OPS = {'mean': (0, 0.0),
+                  'median': (3, 50.0),
+                  'min': (1, 0.0),
+                  'max': (2, 0.0)}
+_COMPOSITE_PCTL_RE = re.compile(r'^pctl_(\d+)$')
+
+
+def _l2_cache_size():
+    """
+    Size of the L2 cache in bytes, 256 KiB if it cannot be queried
+    :return: int
+    """
+    try:
+        size = os.sysconf('SC_LEVEL2_CACHE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        size = 0
+
+    return size if size > 0 else 256 * 2 ** 10
+
+
+def _cache_tile_size(block_size,
+                     raster_size,
+                     pixel_bytes):
+    """
+    Tile size made of whole raster blocks, growing until the tile fills half of the L2 cache.
+    The tile is at least one block, and grows past the cache size up to _MIN_TILE_PIXELS pixels
+    :param block_size: (x, y) block size of the raster
+    :param raster_size: (columns, rows) of the raster
+    :param pixel_bytes: Bytes per pixel for all layers of the tile
+    :return: Tuple of (tile columns, tile rows)
+    """
+    block_xsize, block_ysize = block_size
+    ncols, nrows = raster_size
+    max_pixels = max(_MIN_TILE_PIXELS, _l2_cache_size() // 2 // pixel_bytes)
+
+    # grow along rows first, as blocks are most often full width strips or squares
+    tile_xsize, tile_ysize = min(block_xsize, ncols), min(block_ysize, nrows)
+
+    while tile_ysize < nrows and tile_xsize * (tile_ysize + block_ysize) <= max_pixels:
+        tile_ysize += block_ysize
+    while tile_xsize < ncols and (tile_xsize + block_xsize) * tile_ysize <= max_pixels:
+        tile_xsize += block_xsize
+
+    return min(tile_xsize, ncols), min(tile_ysize, nrows)
+
+
+def set_gdal_perf_options(cachemax=None,
+                          num_threads=None,
+                          disable_readdir=None):
+    """
+    Set GDAL configuration options that affect raster I/O speed
+    :param cachemax: Size of the GDAL block cache in MB
+    :param num_threads: Number of threads GDAL may use for compression and warping (e.g. 4 or 'ALL_CPUS').
+                        This is a process-wide setting, geosoup does not change it on import
+    :param disable_readdir: If GDAL should not list the directory of each file it opens (True or False).
+                            Opening is faster in large directories, but sidecar files
+                            (.aux.xml, .ovr, .msk) are then not found
+    :return: None
+    """
+    if cachemax is not None:
+        gdal.SetCacheMax(int(cachemax) * 2 ** 20)
+
+    if num_threads is not None:
+        gdal.SetConfigOption('GDAL_NUM_THREADS', str(num_threads).upper())
+
+    if disable_readdir is not None:
+        gdal.SetConfigOption('GDAL_DISABLE_READDIR_ON_OPEN', 'TRUE' if disable_readdir else 'FALSE')
+
+
+def _gather_by_mask(tile_arr,
+                    mask_arr,
+                    band_order,
+                    nvals):
+    """
+    Gather the pixels of a burned mask grouped by burn value, and their band values
+    :param tile_arr: 3d numpy array (bands, rows, cols)
+    :param mask_arr: 2d numpy array of burn values (rows, cols), 0 for background
+    :param band_order: 1d numpy array of band indices (starting at 0) to gather
+    :param nvals: Largest burn value
+    :return: Tuple of (starts, rows, cols, values). Pixels of burn value k are at [starts[k]:starts[k + 1]]
+             in the rows, cols, and values (pixels x bands) arrays
+    """
+    pixel_loc = np.flatnonzero(mask_arr)
+    pixel_burn_vals = mask_arr.ravel()[pixel_loc]
+    sort_order = np.argsort(pixel_burn_vals, kind='stable')
+    pixel_loc = pixel_loc[sort_order]
+    pixel_burn_vals = pixel_burn_vals[sort_order]
+    pixel_rows, pixel_cols = np.divmod(pixel_loc, mask_arr.shape[1])
+
+    starts = np.searchsorted(pixel_burn_vals, np.arange(nvals + 2), side='left')
+
+    return starts, pixel_rows, pixel_cols, tile_arr[band_order][:, pixel_rows, pixel_cols].T
+
+
+def _gather_by_mask_kernel(tile_arr,
+                           mask_arr,
+                           band_order,
+                           nvals):
+    """
+    Counting sort version of _gather_by_mask, two passes over the mask
+    :param tile_arr: 3d numpy array (bands, rows, cols)
+    :param mask_arr: 2d numpy array of burn values (rows, cols), 0 for background
+    :param band_order: 1d numpy array of band indices (starting at 0) to gather
+    :param nvals: Largest burn value
+    :return: Tuple of (starts, rows, cols, values) as in _gather_by_mask
+    """
+    nrows, ncols = mask_arr.shape
+    nbands = band_order.shape[0]
+
+    counts = np.zeros(nvals + 1, np.int64)
+    for i in range(nrows):
+        for j in range(ncols):
+            counts[mask_arr[i, j]] += 1
+
+    starts = np.zeros(nvals + 2, np.int64)
+    for k in range(1, nvals + 1):
+        starts[k + 1] = starts[k] + counts[k]
+
+    npix = starts[nvals + 1]
+    pixel_rows = np.empty(npix, np.int64)
+    pixel_cols = np.empty(npix, np.int64)
+    pixel_values = np.empty((npix, nbands), tile_arr.dtype)
+
+    fill = starts.copy()
+    for i in range(nrows):
+        for j in range(ncols):
+            k = mask_arr[i, j]
+            if k > 0:
+                p = fill[k]
+                fill[k] += 1
+                pixel_rows[p] = i
+                pixel_cols[p] = j
+                for b in range(nbands):
+                    pixel_values[p, b] = tile_arr[band_order[b], i, j]
+
+    return starts, pixel_rows, pixel_cols, pixel_values
+
 
-__all__ = ['Raster', 'MultiRaster']
+if njit is not None:
+    _gather_by_mask = njit(cache=True)(_gather_by_mask_kernel)
+
+
+def _append_rows(store,
+                 rows):
+    """
+    Append rows to a growing 2d array, doubling its capacity when full
+    :param store: List of [2d numpy array or None, number of rows in use], updated in place
+    :param rows: 2d numpy array of rows to append
+    :return: None
+    """
+    arr, nrows = store
+    nrows_new = nrows + rows.shape[0]
+
+    if arr is None or nrows_new > arr.shape[0]:
+        capacity = max(nrows_new, 2 * (0 if arr is None else arr.shape[0]), 16)
+        new_arr = np.empty((capacity, rows.shape[1]), dtype=rows.dtype)
+        if arr is not None:
+            new_arr[:nrows] = arr[:nrows]
+        store[0] = arr = new_arr
+
+    arr[nrows:nrows_new] = rows
+    store[1] = nrows_new
+
+
+def _rows_in_use(store,
+                 ncols,
+                 dtype):
+    """
+    Rows in use of a growing 2d array filled by _append_rows
+    :param store: List of [2d numpy array or None, number of rows in use]
+    :param ncols: Number of columns of the empty array if nothing was appended
+    :param dtype: Data type of the empty array if nothing was appended
+    :return: 2d numpy array
+    """
+    arr, nrows = store
+    if arr is None:
+        return np.empty((0, ncols), dtype=dtype)
+    return arr[:nrows]
+
+
+def _kth_smallest(buf,
+                  n,
+                  k):
+    """
+    Wirth's selection of the k-th smallest of the first n values of a buffer, partially reorders the buffer.
+    All values after position k are then >= the k-th smallest
+    :param buf: 1d numpy array
+    :param n: Number of values in use
+    :param k: Rank to select (starting at 0)
+    :return: k-th smallest value
+    """
+    lo = 0
+    hi = n - 1
+    while lo < hi:
+        x = buf[k]
+        i = lo
+        j = hi
+        while True:
+            while buf[i] < x:
+                i += 1
+            while x < buf[j]:
+                j -= 1
+            if i <= j:
+                tmp = buf[i]
+                buf[i] = buf[j]
+                buf[j] = tmp
+                i += 1
+                j -= 1
+            if i > j:
+                break
+        if j < k:
+            lo = i
+        if k < i:
+            hi = j
+    return buf[k]
+
+
+def _composite_kernel(tile_arr,
+                      nodata,
+                      has_nodata,
+                      op_code,
+                      pctl,
+                      out):
+    """
+    Per pixel reduction of a tile over the layer axis, ignoring nodata and NaN values.
+    Percentiles use linear interpolation as numpy.percentile, found by selection instead of sorting
+    :param tile_arr: 3d numpy array (layers, rows, cols)
+    :param nodata: Nodata value
+    :param has_nodata: If nodata values should be ignored
+    :param op_code: 0: mean, 1: min, 2: max, 3: percentile
+    :param pctl: Percentile (0 - 100) for op_code 3
+    :param out: 2d float numpy array (rows, cols) for the result, NaN where no values are valid
+    :return: None
+    """
+    nlayers, nrows, ncols = tile_arr.shape
+
+    for i in prange(nrows):
+        buf = np.empty(nlayers, np.float64)
+        for j in range(ncols):
+            n = 0
+            for b in range(nlayers):
+                v = tile_arr[b, i, j]
+                if (has_nodata and v == nodata) or v != v:
+                    continue
+                buf[n] = v
+                n += 1
+
+            if n == 0:
+                out[i, j] = np.nan
+            elif op_code == 0:
+                total = 0.0
+                for b in range(n):
+                    total += buf[b]
+                out[i, j] = total / n
+            elif op_code == 1:
+                result = buf[0]
+                for b in range(1, n):
+                    if buf[b] < result:
+                        result = buf[b]
+                out[i, j] = result
+            elif op_code == 2:
+                result = buf[0]
+                for b in range(1, n):
+                    if buf[b] > result:
+                        result = buf[b]
+                out[i, j] = result
+            else:
+                rank = pctl / 100.0 * (n - 1)
+                k = int(np.floor(rank))
+                low = _kth_smallest(buf, n, k)
+                if k + 1 < n and rank > k:
+                    high = buf[k + 1]
+                    for b in range(k + 2, n):
+                        if buf[b] < high:
+                            high = buf[b]
+                    out[i, j] = low + (high - low) * (rank - k)
+                else:
+                    out[i, j] = low
+
+
+if njit is not None:
+    _kth_smallest = njit(cache=True)(_kth_smallest)
+    _composite_kernel = njit(cache=True, parallel=True, nogil=True)(_composite_kernel)
+else:
+    _composite_kernel = None
+
+
+def _terrain_kernel(strip,
+                    invalid,
+                    ewres,
+                    nsres,
+                    horn,
+                    z_factor,
+                    zenith,
+                    azimuth_math,
+                    slope_percent,
+                    flat_aspect,
+                    slope_out,
+                    aspect_out,
+                    hillshade_out):
+    """
+    Slope, aspect and hillshade of a DEM strip from one gradient computation per pixel.
+    Hillshade is scaled to 1-255 as in gdaldem, fully shadowed pixels get 1.
+    Pixels with an invalid value in their 3x3 window get -9999 (slope, aspect) and 0 (hillshade)
+    :param strip: 2d float numpy array (rows + 2, cols + 2) of elevations including a one pixel halo
+    :param invalid: 2d bool numpy array of the same shape, True for nodata
+    :param ewres: East-west pixel size in vertical units
+    :param nsres: North-south pixel size in vertical units
+    :param horn: Horn (8-neighbor) gradients if True, else Zevenbergen-Thorne (4-neighbor)
+    :param z_factor: Vertical exaggeration for hillshade
+    :param zenith: Zenith angle of the light in radians
+    :param azimuth_math: Azimuth of the light in radians, counterclockwise from east
+    :param slope_percent: Slope in percent if True, else in degrees
+    :param flat_aspect: Aspect of flat pixels
+    :param slope_out: 2d float numpy array (rows, cols) for slope
+    :param aspect_out: 2d float numpy array (rows, cols) for aspect
+    :param hillshade_out: 2d numpy array (rows, cols) for hillshade
+    :return: None
+    """
+    nrows = strip.shape[0] - 2
+    ncols = strip.shape[1] - 2
+
+    for i in prange(nrows):
+        for j in range(ncols):
+            skip = False
+            for di in range(3):
+                for dj in range(3):
+                    if invalid[i + di, j + dj]:
+                        skip = True
+            if skip:
+                slope_out[i, j] = -9999.0
+                aspect_out[i, j] = -9999.0
+                hillshade_out[i, j] = 0
+                continue
+
+            if horn:
+                dzdx = ((strip[i, j + 2] + 2.0 * strip[i + 1, j + 2] + strip[i + 2, j + 2]) -
+                        (strip[i, j] + 2.0 * strip[i + 1, j] + strip[i + 2, j])) / (8.0 * ewres)
+                dzdy = ((strip[i + 2, j] + 2.0 * strip[i + 2, j + 1] + strip[i + 2, j + 2]) -
+                        (strip[i, j] + 2.0 * strip[i, j + 1] + strip[i, j + 2])) / (8.0 * nsres)
+            else:
+                # as float, differences of unsigned elevations would wrap around
+                dzdx = (float(strip[i + 1, j + 2]) - float(strip[i + 1, j])) / (2.0 * ewres)
+                dzdy = (float(strip[i + 2, j + 1]) - float(strip[i, j + 1])) / (2.0 * nsres)
+
+            gradient = np.sqrt(dzdx * dzdx + dzdy * dzdy)
+
+            if slope_percent:
+                slope_out[i, j] = 100.0 * gradient
+            else:
+                slope_out[i, j] = np.degrees(np.arctan(gradient))
+
+            if dzdx == 0.0 and dzdy == 0.0:
+                aspect_out[i, j] = flat_aspect
+                aspect_math = 0.0
+            else:
+                aspect_math = np.arctan2(dzdy, -dzdx)
+
+                # compass aspect, clockwise from north
+                aspect = np.degrees(aspect_math)
+                if aspect < 0.0:
+                    aspect = 90.0 - aspect
+                elif aspect > 90.0:
+                    aspect = 450.0 - aspect
+                else:
+                    aspect = 90.0 - aspect
+                aspect_out[i, j] = 0.0 if aspect == 360.0 else aspect
+
+                if aspect_math < 0.0:
+                    aspect_math += 2.0 * np.pi
+
+            slope_rad = np.arctan(z_factor * gradient)
+            cang = (np.cos(zenith) * np.cos(slope_rad) +
+                    np.sin(zenith) * np.sin(slope_rad) * np.cos(azimuth_math - aspect_math))
+            hillshade_out[i, j] = np.floor(1.5 + 254.0 * cang) if cang > 0.0 else 1.0
+
+
+def _terrain_arrays(strip,
+                    invalid,
+                    ewres,
+                    nsres,
+                    horn,
+                    z_factor,
+                    zenith,
+                    azimuth_math,
+                    slope_percent,
+                    flat_aspect,
+                    slope_out,
+                    aspect_out,
+                    hillshade_out):
+    """
+    Numpy version of _terrain_kernel, same parameters
+    :return: None
+    """
+    # any invalid value in the 3x3 window
+    skip = np.zeros(slope_out.shape, dtype=bool)
+    for di in range(3):
+        for dj in range(3):
+            skip |= invalid[di:di + skip.shape[0], dj:dj + skip.shape[1]]
+
+    a, b, c = strip[:-2, :-2], strip[:-2, 1:-1], strip[:-2, 2:]
+    d, f = strip[1:-1, :-2], strip[1:-1, 2:]
+    g, h, k = strip[2:, :-2], strip[2:, 1:-1], strip[2:, 2:]
+
+    if horn:
+        dzdx = ((c + 2.0 * f + k) - (a + 2.0 * d + g)) / (8.0 * ewres)
+        dzdy = ((g + 2.0 * h + k) - (a + 2.0 * b + c)) / (8.0 * nsres)
+    else:
+        dzdx = np.subtract(f, d, dtype=np.float64) / (2.0 * ewres)
+        dzdy = np.subtract(h, b, dtype=np.float64) / (2.0 * nsres)
+
+    gradient = np.hypot(dzdx, dzdy)
+    flat = (dzdx == 0) & (dzdy == 0)
+
+    if slope_percent:
+        slope_out[:] = 100.0 * gradient
+    else:
+        slope_out[:] = np.degrees(np.arctan(gradient))
+
+    aspect_math = np.arctan2(dzdy, -dzdx)
+
+    # compass aspect, clockwise from north
+    aspect = np.degrees(aspect_math)
+    aspect = np.where(aspect < 0, 90.0 - aspect, np.where(aspect > 90.0, 450.0 - aspect, 90.0 - aspect))
+    aspect[aspect == 360.0] = 0.0
+    aspect[flat] = flat_aspect
+    aspect_out[:] = aspect
+
+    aspect_math[aspect_math < 0] += 2.0 * np.pi
+    aspect_math[flat] = 0.0
+
+    slope_rad = np.arctan(z_factor * gradient)
+    cang = (np.cos(zenith) * np.cos(slope_rad) +
+            np.sin(zenith) * np.sin(slope_rad) * np.cos(azimuth_math - aspect_math))
+    hillshade_out[:] = np.where(cang > 0.0, np.floor(1.5 + 254.0 * cang), 1.0)
+
+    slope_out[skip] = -9999.0
+    aspect_out[skip] = -9999.0
+    hillshade_out[skip] = 0
+
+
+if njit is not None:
+    _terrain_kernel = njit(cache=True, parallel=True)(_terrain_kernel)
+else:
+    _terrain_kernel = _terrain_arrays
 
 
 class Raster(object):
@@ -38,11 +545,23 @@ class Raster(object):
         self.dtype = dtype
         self.metadict = metadict
         self.nodatavalue = None
-        self.tile_grid = list()
+        self.tile_block_coords = None  # array of (x, y, cols, rows) per tile
+        self.tile_tie_points = None  # array of (x, y) tie point coordinates per tile
+        self.tile_end_points = None  # array of (x, y) coordinates of the corner opposite the tie point per tile
         self.ntiles = None
+        self._tile_first_pixel = None
+        self._tile_grid = None
         self.bounds = None
         self.init = False
         self.stats = dict()
+        self.use_memmap = False
+        self._gdal_dtype = None
+        self._np_dtype = None
+        self.block_size = None  # (x, y) block size of the first band
+        self.ulx = None
+        self.uly = None
+        self.xpixel = None
+        self.ypixel = None
 
     def __repr__(self):
 
@@ -71,15 +590,14 @@ class Raster(object):
         :param outfile: Name of output file
         :param add_overview: If an external overview should be added to the file (useful for display)
         :param resampling: resampling type for overview (nearest, cubic, average, mode, etc.)
-        :param overviews: list of overviews to compute( default: [2, 4, 8, 16, 32, 64, 128, 256])
+        :param overviews: list of overviews to compute (default: powers of 2 down to about 256 pixels)
         :param verbose: If the steps should be displayed
         :param kwargs: keyword arguments for creation options
+                       GTiff files are tiled (256x256) and DEFLATE compressed with a predictor by default
         """
-        creation_options = []
-        if len(kwargs) > 0:
-            for key, value in kwargs.items():
-                creation_options.append('{}={}'.format(key.upper(),
-                                                       value.upper()))
+        creation_options = self._creation_options(self.dtype,
+                                                  driver,
+                                                  **kwargs)
         if outfile is None:
 
             if driver == 'MEM':
@@ -91,39 +609,44 @@ class Raster(object):
         if verbose:
             Opt.cprint('\nWriting {}\n'.format(outfile))
 
-        gtiffdriver = gdal.GetDriverByName(driver)
+        gtiffdriver = _GTIFF_DRIVER if driver == 'GTiff' else gdal.GetDriverByName(driver)
         fileptr = gtiffdriver.Create(outfile, self.shape[2], self.shape[1],
                                      self.shape[0], self.dtype, creation_options)
         nbands = self.shape[0]
         fileptr.SetGeoTransform(self.transform)
         fileptr.SetProjection(self.crs_string)
 
-        if len(self.bnames) > 0:
-            for i, bname in enumerate(self.bnames):
-                if len(bname) == 0:
-                    self.bnames[i] = 'band_{}'.format(str(i + 1))
-        else:
-            for i in range(self.shape[0]):
-                self.bnames[i] = 'band_{}'.format(str(i + 1))
+        # names for bands without one
+        bnames = self.bnames if self.bnames is not None else list()
+        self.bnames = list(bnames[i] if i < len(bnames) and len(bnames[i]) > 0 else 'band_{}'.format(i + 1)
+                           for i in range(nbands))
 
         if self.array is None:
             self.read_array()
 
         if nbands == 1:
-            fileptr.GetRasterBand(1).WriteArray(self.array, 0, 0)
-            fileptr.GetRasterBand(1).SetDescription(self.bnames[0])
+            band = fileptr.GetRasterBand(1)
+            band.WriteArray(self.array, 0, 0)
+            band.SetDescription(self.bnames[0])
 
             if self.nodatavalue is not None:
-                fileptr.GetRasterBand(1).SetNoDataValue(self.nodatavalue)
+                band.SetNoDataValue(self.nodatavalue)
             if verbose:
                 Opt.cprint('Writing band: ' + self.bnames[0])
         else:
+            # write all bands in one call, the buffer has to match the output data type
+            fileptr.WriteRaster(0, 0, self.shape[2], self.shape[1],
+                                np.ascontiguousarray(self.array,
+                                                     dtype=gdal_array.GDALTypeCodeToNumericTypeCode(self.dtype)),
+                                buf_type=self.dtype,
+                                band_list=list(range(1, nbands + 1)))
+
             for i in range(0, nbands):
-                fileptr.GetRasterBand(i + 1).WriteArray(self.array[i, :, :], 0, 0)
-                fileptr.GetRasterBand(i + 1).SetDescription(self.bnames[i])
+                band = fileptr.GetRasterBand(i + 1)
+                band.SetDescription(self.bnames[i])
 
                 if self.nodatavalue is not None:
-                    fileptr.GetRasterBand(i + 1).SetNoDataValue(self.nodatavalue)
+                    band.SetNoDataValue(self.nodatavalue)
                 if verbose:
                     Opt.cprint('Writing band: ' + self.bnames[i])
 
@@ -144,22 +667,123 @@ class Raster(object):
             if verbose:
                 Opt.cprint('Overview written to disk!')
 
+    @staticmethod
+    def _creation_options(dtype,
+                          driver='GTiff',
+                          **kwargs):
+        """
+        Make the list of creation options for a new raster file
+        :param dtype: GDAL data type of the raster
+        :param driver: raster driver
+        :param kwargs: keyword arguments for creation options, these override the GTiff defaults
+        :return: list of 'KEY=VALUE' strings
+        """
+        creation_dict = dict()
+        if driver == 'GTiff':
+            creation_dict.update(_GTIFF_CREATION_OPTIONS)
+
+            dtype_kind = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(dtype)).kind
+            if dtype_kind == 'f':
+                creation_dict['PREDICTOR'] = '3'
+            elif dtype_kind in 'iu':
+                creation_dict['PREDICTOR'] = '2'
+
+        for key, value in kwargs.items():
+            creation_dict[key.upper()] = value.upper()
+
+        return list('{}={}'.format(key, value) for key, value in creation_dict.items())
+
+    def _create_like(self,
+                     outfile,
+                     dtype=None,
+                     nodatavalue=None):
+        """
+        Create an empty GTiff raster with the size, bands and georeferencing of this raster
+        :param outfile: Output file name
+        :param dtype: GDAL data type of the output (default: data type of this raster)
+        :param nodatavalue: no data value of the output
+        :return: Raster object with the open dataset as datasource
+        """
+        if dtype is None:
+            dtype = self.dtype
+
+        fileptr = _GTIFF_DRIVER.Create(outfile, self.shape[2], self.shape[1], self.shape[0], dtype,
+                                       self._creation_options(dtype))
+        fileptr.SetGeoTransform(self.transform)
+        fileptr.SetProjection(self.crs_string)
+
+        for i, bname in enumerate(self.bnames):
+            band = fileptr.GetRasterBand(i + 1)
+            band.SetDescription(bname)
+
+            if nodatavalue is not None:
+                band.SetNoDataValue(nodatavalue)
+
+        out_raster = Raster(outfile)
+        out_raster.datasource = fileptr
+
+        return out_raster
+
+    def apply_over_blocks(self,
+                          func,
+                          dst=None,
+                          band_list=None,
+                          inplace=False):
+        """
+        Apply a function to the raster block by block along the GDAL block grid
+        and write the output blocks to another raster or back to this raster
+        :param func: Function that takes a 3d block array (bands, rows, cols) and returns an array of the same shape.
+                     The input array buffer is reused for the next block, it can be modified in place
+        :param dst: Raster object with an open datasource of the same size to write to (same band indices)
+        :param band_list: List of bands, index starts from one (default: all)
+        :param inplace: If the output blocks should be written back to this raster file (ignored if dst is given)
+        :return: None
+        """
+        if dst is None and not inplace:
+            raise ValueError('Output raster (dst) or inplace=True is needed')
+
+        if not self.init:
+            self.initialize()
+
+        if band_list is None:
+            band_list = list(range(1, self.shape[0] + 1))
+
+        if dst is not None:
+            out_fileptr = dst.datasource
+        else:
+            # reopen in update mode, reading and writing through the same dataset
+            self.datasource = gdal.Open(self.name, gdal.GA_Update)
+            out_fileptr = self.datasource
+
+        for xoff, yoff, block_arr in self.iter_blocks(band_list):
+            out_arr = np.ascontiguousarray(func(block_arr))
+
+            out_fileptr.WriteRaster(xoff, yoff, block_arr.shape[2], block_arr.shape[1], out_arr,
+                                    buf_type=gdal_array.NumericTypeCodeToGDALTypeCode(out_arr.dtype),
+                                    band_list=band_list)
+
+        out_fileptr.FlushCache()
+
     def add_overviews(self,
                       resampling='nearest',
                       overviews=None,
                       **kwargs):
         """
-        Method to create raster overviews
-        :param resampling:
-        :param overviews:
-        :param kwargs:
+        Method to create internal raster overviews, compressed with DEFLATE by default
+        :param resampling: resampling type for overview (nearest, cubic, average, mode, etc.)
+        :param overviews: list of overviews to compute (default: powers of 2 down to about 256 pixels)
+        :param kwargs: overview creation options, e.g. compress='LZW' sets COMPRESS_OVERVIEW=LZW
         :return:
         """
 
-        fileptr = gdal.Open(self.name, 0)
+        # open in update mode so that overviews are written inside the file
+        fileptr = gdal.Open(self.name, gdal.GA_Update)
 
         if overviews is None:
-            overviews = [2, 4, 8, 16, 32, 64, 128, 256]
+            max_size = max(fileptr.RasterXSize, fileptr.RasterYSize)
+            overviews = [2]
+            while max_size // (overviews[-1] * 2) >= 256:
+                overviews.append(overviews[-1] * 2)
 
         if type(overviews) not in (list, tuple):
             if type(overviews) in (str, float):
@@ -182,19 +806,38 @@ class Raster(object):
 
                 overviews = overviews_
 
+        # default config options, overridden by kwargs
+        float_type = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(fileptr.GetRasterBand(1).DataType)).kind == 'f'
+        config_options = {'COMPRESS_OVERVIEW': 'DEFLATE',
+                          'PREDICTOR_OVERVIEW': '3' if float_type else '2',
+                          'GDAL_NUM_THREADS': 'ALL_CPUS'}
+
         for k, v in kwargs.items():
-            gdal.SetConfigOption('{}_OVERVIEW'.format(k.upper()), v.upper())
+            config_options['{}_OVERVIEW'.format(k.upper())] = v.upper()
 
-        fileptr.BuildOverviews(resampling.upper(), overviews)
-        fileptr = None
+        # config options are global in GDAL, restore them afterwards
+        old_options = dict((k, gdal.GetConfigOption(k)) for k in config_options)
+
+        try:
+            for k, v in config_options.items():
+                gdal.SetConfigOption(k, v)
+
+            fileptr.BuildOverviews(resampling.upper(), overviews)
+        finally:
+            fileptr = None
+
+            for k, v in old_options.items():
+                gdal.SetConfigOption(k, v)
 
     def read_array(self,
                    offsets=None,
-                   band_order=None):
+                   band_order=None,
+                   max_pixels=None):
         """
         read raster array with offsets
         :param offsets: tuple or list - (xoffset, yoffset, xcount, ycount)
         :param band_order: order of bands to read
+        :param max_pixels: Maximum number of pixels to read into memory (default: MAX_PIXELS)
         """
 
         if not self.init:
@@ -209,25 +852,23 @@ class Raster(object):
         else:
             self.array_offsets = offsets
 
-        array3d = np.zeros((nbands,
-                            self.array_offsets[3],
-                            self.array_offsets[2]),
-                           gdal_array.GDALTypeCodeToNumericTypeCode(fileptr.GetRasterBand(1).DataType))
-
         # read array and store the band values and name in array
         if band_order is not None:
-            for b in band_order:
-                self.bnames.append(self.datasource.GetRasterBand(b + 1).GetDescription())
+            self.bnames += self._band_names(self.datasource, band_order)
         else:
             band_order = list(range(nbands))
 
-        # read array and store the band values and name in array
-        for i, b in enumerate(band_order):
-            if self.array_offsets is None:
-                array3d[i, :, :] = fileptr.GetRasterBand(b + 1).ReadAsArray()
-            else:
-                array3d[i, :, :] = fileptr.GetRasterBand(b + 1).ReadAsArray(*self.array_offsets,
-                                                                            resample_alg=gdalconst.GRA_NearestNeighbour)
+        array3d = self._alloc((len(band_order),
+                               self.array_offsets[3],
+                               self.array_offsets[2]),
+                              self._np_dtype,
+                              max_pixels)
+
+        # read all bands in one call
+        fileptr.ReadAsArray(*self.array_offsets,
+                            buf_obj=array3d,
+                            band_list=list(b + 1 for b in band_order),
+                            resample_alg=gdalconst.GRA_NearestNeighbour)
 
         if (self.shape[0] == 1) and (len(array3d.shape) > 2):
             self.array = array3d.reshape([self.array_offsets[3],
@@ -241,7 +882,10 @@ class Raster(object):
                    finite_only=True,
                    nan_replacement=0.0,
                    use_dict=None,
-                   sensor=None):
+                   sensor=None,
+                   use_memmap=None,
+                   max_pixels=None,
+                   verbose=False):
 
         """
         Initialize a raster object from a file
@@ -252,15 +896,23 @@ class Raster(object):
         :param use_dict: Dictionary to use for renaming bands
         :param sensor: Sensor to be used with dictionary (resources.bname_dict)
         (ignored if finite_only, get_array is false)
+        :param use_memmap: If the raster array should be held in a memory mapped temporary file
+                           instead of memory (default: None, keeps the current setting)
+        :param max_pixels: Maximum number of pixels to read into memory (default: MAX_PIXELS)
+        :param verbose: If the number of replaced non-finite values should be printed
         :return None
         """
         self.init = True
+        if use_memmap is not None:
+            self.use_memmap = use_memmap
+
         raster_name = self.name
 
         if Handler(raster_name).file_exists() or 'vsimem' in self.name:
             fileptr = gdal.Open(raster_name)  # open file
             self.datasource = fileptr
-            self.metadict = Raster.get_raster_metadict(file_name=raster_name)
+            self.metadict = Raster.get_raster_metadict(file_name=raster_name,
+                                                       file_ptr=fileptr)
 
         elif self.datasource is not None:
             fileptr = self.datasource
@@ -274,28 +926,35 @@ class Raster(object):
         rows = fileptr.RasterYSize
         cols = fileptr.RasterXSize
 
+        first_band = fileptr.GetRasterBand(1)
+        self._gdal_dtype = first_band.DataType
+        self._np_dtype = gdal_array.GDALTypeCodeToNumericTypeCode(self._gdal_dtype)
+        self.block_size = tuple(first_band.GetBlockSize())
+
         # if get_array flag is true
         if get_array:
 
-            # get band names
-            names = list()
-
             # band order
             if band_order is None:
-                array3d = fileptr.ReadAsArray()
+                if bands == 1:
+                    array3d = self._alloc((rows, cols), self._np_dtype, max_pixels)
+                else:
+                    array3d = self._alloc((bands, rows, cols), self._np_dtype, max_pixels)
+                fileptr.ReadAsArray(buf_obj=array3d)
 
                 # if flag for finite values is present
-                if finite_only:
-                    if np.isnan(array3d).any() or np.isinf(array3d).any():
-                        array3d[np.isnan(array3d)] = nan_replacement
-                        array3d[np.isinf(array3d)] = nan_replacement
-                        Opt.cprint("Non-finite values replaced with " + str(nan_replacement))
-                    else:
-                        Opt.cprint("Non-finite values absent in file")
+                if finite_only and array3d.dtype.kind in 'fc':
+                    n_replaced = np.count_nonzero(~np.isfinite(array3d)) if verbose else 0
+                    np.nan_to_num(array3d,
+                                  copy=False,
+                                  nan=nan_replacement,
+                                  posinf=nan_replacement,
+                                  neginf=nan_replacement)
+                    if n_replaced > 0:
+                        Opt.cprint("{} non-finite values replaced with {}".format(n_replaced, nan_replacement))
 
                 # get band names
-                for i in range(0, bands):
-                    names.append(fileptr.GetRasterBand(i + 1).GetDescription())
+                names = self._band_names(fileptr)
 
             # band order present
             else:
@@ -308,36 +967,35 @@ class Raster(object):
 
                 # initialize array
                 if self.array_offsets is None:
-                    array3d = np.zeros((n_array_bands,
-                                        rows,
-                                        cols),
-                                       gdal_array.GDALTypeCodeToNumericTypeCode(fileptr.GetRasterBand(1).DataType))
+                    offsets = (0, 0, cols, rows)
                 else:
-                    array3d = np.zeros((n_array_bands,
-                                        self.array_offsets[3],
-                                        self.array_offsets[2]),
-                                       gdal_array.GDALTypeCodeToNumericTypeCode(fileptr.GetRasterBand(1).DataType))
+                    offsets = self.array_offsets
 
-                # read array and store the band values and name in array
-                for i, b in enumerate(band_order):
-                    bandname = fileptr.GetRasterBand(b + 1).GetDescription()
-                    Opt.cprint('Reading band {}'.format(bandname))
+                array3d = self._alloc((n_array_bands,
+                                       offsets[3],
+                                       offsets[2]),
+                                      self._np_dtype,
+                                      max_pixels)
 
-                    if self.array_offsets is None:
-                        array3d[i, :, :] = fileptr.GetRasterBand(b + 1).ReadAsArray()
-                    else:
-                        array3d[i, :, :] = fileptr.GetRasterBand(b + 1).ReadAsArray(*self.array_offsets)
+                # get band names
+                names = self._band_names(fileptr, band_order)
+                Opt.cprint('Reading band names: {}'.format(" ".join(names)))
 
-                    names.append(bandname)
+                # read all bands in one call
+                fileptr.ReadAsArray(*offsets,
+                                    buf_obj=array3d,
+                                    band_list=list(b + 1 for b in band_order))
 
                 # if flag for finite values is present
-                if finite_only:
-                    if np.isnan(array3d).any() or np.isinf(array3d).any():
-                        array3d[np.isnan(array3d)] = nan_replacement
-                        array3d[np.isinf(array3d)] = nan_replacement
-                        Opt.cprint("Non-finite values replaced with " + str(nan_replacement))
-                    else:
-                        Opt.cprint("Non-finite values absent in file")
+                if finite_only and array3d.dtype.kind in 'fc':
+                    n_replaced = np.count_nonzero(~np.isfinite(array3d)) if verbose else 0
+                    np.nan_to_num(array3d,
+                                  copy=False,
+                                  nan=nan_replacement,
+                                  posinf=nan_replacement,
+                                  neginf=nan_replacement)
+                    if n_replaced > 0:
+                        Opt.cprint("{} non-finite values replaced with {}".format(n_replaced, nan_replacement))
 
             # assign to empty class object
             self.array = array3d
@@ -345,22 +1003,21 @@ class Raster(object):
             self.shape = [bands, rows, cols]
             self.transform = fileptr.GetGeoTransform()
             self.crs_string = fileptr.GetProjection()
-            self.dtype = fileptr.GetRasterBand(1).DataType
+            self.dtype = self._gdal_dtype
 
         # if get_array is false
         else:
-            # get band names
-            names = list()
-            for i in range(0, bands):
-                names.append(fileptr.GetRasterBand(i + 1).GetDescription())
-
             # assign to empty class object without the array
-            self.bnames = names
+            self.bnames = self._band_names(fileptr)
             self.shape = [bands, rows, cols]
             self.transform = fileptr.GetGeoTransform()
             self.crs_string = fileptr.GetProjection()
-            self.dtype = fileptr.GetRasterBand(1).DataType
-            self.nodatavalue = fileptr.GetRasterBand(1).GetNoDataValue()
+            self.dtype = self._gdal_dtype
+            self.nodatavalue = first_band.GetNoDataValue()
+
+        # tie point and pixel size
+        self.ulx, self.uly = float(self.transform[0]), float(self.transform[3])
+        self.xpixel, self.ypixel = abs(float(self.transform[1])), abs(float(self.transform[5]))
 
         self.bounds = self.get_bounds()
 
@@ -368,6 +1025,63 @@ class Raster(object):
         if use_dict is not None:
             self.bnames = [use_dict[sensor][b] for b in self.bnames]
 
+    @staticmethod
+    def _band_names(fileptr,
+                    band_order=None):
+        """
+        Get band descriptions from a GDAL dataset, 'band_<n>' for bands without one
+        :param fileptr: GDAL dataset
+        :param band_order: list of band indices starting at 0 (default: all bands)
+        :return: list of band names
+        """
+        if band_order is None:
+            band_order = range(fileptr.RasterCount)
+
+        return list(fileptr.GetRasterBand(b + 1).GetDescription() or 'band_{}'.format(b + 1)
+                    for b in band_order)
+
+    def _alloc(self,
+               shape,
+               dtype,
+               max_pixels=None):
+        """
+        Allocate an uninitialized array for raster data
+        :param shape: Array shape
+        :param dtype: Numpy data type
+        :param max_pixels: Maximum number of pixels for an in-memory array (default: MAX_PIXELS)
+        :return: numpy memmap on an anonymous temporary file if use_memmap is set, else numpy array
+        """
+        if self.use_memmap:
+            # the temporary file is unlinked on creation and lives as long as the mapping
+            with tempfile.TemporaryFile() as tmpfile:
+                return np.memmap(tmpfile, dtype=dtype, mode='w+', shape=shape)
+        else:
+            self._check_dimensions(shape, dtype, max_pixels)
+            return np.empty(shape, dtype)
+
+    @staticmethod
+    def _check_dimensions(shape,
+                          dtype,
+                          max_pixels=None):
+        """
+        Raise an error before allocating an array with more than max_pixels pixels
+        :param shape: Array shape
+        :param dtype: Numpy data type
+        :param max_pixels: Maximum number of pixels (default: MAX_PIXELS)
+        :return: None
+        """
+        if max_pixels is None:
+            max_pixels = MAX_PIXELS
+
+        npixels = int(np.prod(shape, dtype=np.int64))
+
+        if npixels > max_pixels:
+            raise ValueError('Array of shape {} needs {:.2f} GiB, more than max_pixels={} pixels. '.format(
+                                 tuple(shape),
+                                 npixels * np.dtype(dtype).itemsize / 2.0 ** 30,
+                                 max_pixels) +
+                             'Use Raster.iter_blocks() to read by block, or initialize with use_memmap=True')
+
     def set_nodataval(self,
                       in_nodataval=255,
                       out_nodataval=0,
@@ -380,12 +1094,28 @@ class Raster(object):
         :param out_nodataval: no data value in output raster
         :param in_array: if the no data value should be changed in raster array
         :param outfile: output file name
+                        (if the raster array is not read, the file is written block by block to outfile)
         """
+        if in_array and self.array is None and outfile is not None:
+            if not self.init:
+                self.initialize(**kwargs)
+
+            def replace_nodata(block_arr):
+                np.putmask(block_arr, block_arr == in_nodataval, out_nodataval)
+                return block_arr
+
+            out_raster = self._create_like(outfile, nodatavalue=out_nodataval)
+            self.apply_over_blocks(replace_nodata, dst=out_raster)
+            out_raster.datasource = None
+
+            self.nodatavalue = out_nodataval
+            return
+
         if in_array:
             if not self.init:
                 self.initialize(get_array=True,
                                 **kwargs)
-            self.array[np.where(self.array == in_nodataval)] = out_nodataval
+            np.putmask(self.array, self.array == in_nodataval, out_nodataval)
 
         self.nodatavalue = out_nodataval
 
@@ -399,29 +1129,77 @@ class Raster(object):
         :return: bool
         """
         if Handler(self.name).file_exists():
-            fileptr = gdal.Open(self.name)
+            if not self.init:
+                self.initialize()
+
+            # integer bands always have finite values
+            if np.dtype(self._np_dtype).kind not in 'fc':
+                return False
+
+            # stop reading a band at its first block with a finite value,
+            # and stop checking at the first band without any
+            for ib in range(self.shape[0]):
+                for _, _, block_arr in self.iter_blocks(band_list=[ib + 1]):
+                    if np.isfinite(block_arr).any():
+                        break
+                else:
+                    return True
+
+            return False
+        else:
+            raise ValueError("File does not exist.")
 
-            filearr = fileptr.ReadAsArray()
-            nb, ns, nl = filearr.shape
+    def iter_blocks(self,
+                    band_list=None,
+                    block_size=None):
+        """
+        Generator to read the raster block by block along the GDAL block grid
+        :param band_list: List of bands to read, index starts from one (default: all)
+        :param block_size: Tuple of block size along x and y (default: block size of the first band in band_list)
+        :return: Yields tuple: (x offset, y offset, 3d numpy array of shape (bands, rows, cols))
+                 The array buffer is reused for the next block, copy it to keep it
+        """
+        if not self.init:
+            self.initialize()
 
-            truth_about_empty_bands = [np.isfinite(filearr[i, :, :]).any() for i in range(0, nb)]
+        if band_list is None:
+            band_list = list(range(1, self.shape[0] + 1))
 
-            fileptr = None
+        if block_size is None:
+            block_size = self.datasource.GetRasterBand(band_list[0]).GetBlockSize()
 
-            return any([not x for x in truth_about_empty_bands])
-        else:
-            raise ValueError("File does not exist.")
+        nbands, rows, cols = len(band_list), self.shape[1], self.shape[2]
+        block_xsize, block_ysize = block_size
+
+        # one buffer for all blocks, edge blocks use a view on the front of it
+        block_buf = np.empty(nbands * block_xsize * block_ysize,
+                             dtype=self._np_dtype)
+
+        for yoff in range(0, rows, block_ysize):
+            ysize = min(block_ysize, rows - yoff)
+
+            for xoff in range(0, cols, block_xsize):
+                xsize = min(block_xsize, cols - xoff)
+
+                block_arr = block_buf[:nbands * ysize * xsize].reshape(nbands, ysize, xsize)
+                self.datasource.ReadAsArray(xoff, yoff, xsize, ysize,
+                                            buf_obj=block_arr,
+                                            band_list=band_list)
+
+                yield xoff, yoff, block_arr
 
     def make_tiles(self,
                    tile_size_x,
                    tile_size_y,
-                   out_path):
+                   out_path,
+                   max_workers=8):
 
         """
         Make tiles from the tif file
         :param tile_size_y: Tile size along x
         :param tile_size_x: tile size along y
         :param out_path: Output folder
+        :param max_workers: Maximum number of threads writing tiles in parallel (default: 8)
         :return:
         """
 
@@ -444,66 +1222,45 @@ class Raster(object):
                 # file name without extension (e.g. .tif)
                 out_file_basename = Handler(in_file).basename.split('.')[0]
 
-                # open file
+                # band names from the input file
                 in_file_ptr = gdal.Open(in_file)
+                band_names = list(in_file_ptr.GetRasterBand(k + 1).GetDescription() for k in range(bands))
+                in_file_ptr = None
 
-                # loop through the tiles
+                # list of tiles as (x offset, y offset, x size, y size, output file, geotransform)
+                tiles = list()
                 for i in range(0, cols, tile_size_x):
                     for j in range(0, rows, tile_size_y):
 
                         if (cols - i) != 0 and (rows - j) != 0:
 
-                            # check size of tiles for edge tiles
-                            if (cols - i) < tile_size_x:
-                                tile_size_x = cols - i + 1
-
-                            if (rows - j) < tile_size_y:
-                                tile_size_y = rows - j + 1
+                            # size of this tile, smaller for edge tiles
+                            tsx = min(tile_size_x, cols - i)
+                            tsy = min(tile_size_y, rows - j)
 
                             # name of the output tile
                             out_file_name = str(out_path) + Handler().sep + str(out_file_basename) + \
-                                            "_" + str(i + 1) + "_" + str(j + 1) + ".tif"
+                                "_" + str(i + 1) + "_" + str(j + 1) + ".tif"
 
                             # check if file already exists
                             out_file_name = Handler(filename=out_file_name).file_remove_check()
 
                             # get/calculate spatial parameters
                             new_ul = [ulx + i * px, uly + j * py]
-                            new_lr = [new_ul[0] + px * tile_size_x, new_ul[1] + py * tile_size_y]
                             new_transform = (new_ul[0], px, rotx, new_ul[1], roty, py)
 
-                            # initiate output file
-                            driver = gdal.GetDriverByName("GTiff")
-                            out_file_ptr = driver.Create(out_file_name, tile_size_x, tile_size_y, bands, dtype)
-
-                            for k in range(0, bands):
-                                # get data
-                                band_name = in_file_ptr.GetRasterBand(k + 1).GetDescription()
-                                band = in_file_ptr.GetRasterBand(k + 1)
-                                band_data = band.ReadAsArray(i, j, tile_size_x, tile_size_y)
-
-                                # put data
-                                out_file_ptr.GetRasterBand(k + 1).WriteArray(band_data, 0, 0)
-                                out_file_ptr.GetRasterBand(k + 1).SetDescription(band_name)
-
-                            # set spatial reference and projection parameters
-                            out_file_ptr.SetGeoTransform(new_transform)
-                            out_file_ptr.SetProjection(crs_string)
-
-                            # delete pointers
-                            out_file_ptr.FlushCache()  # save to disk
-                            out_file_ptr = None
-                            driver = None
-
-                            # check for empty tiles
-                            out_raster = Raster(out_file_name)
-                            if out_raster.chk_for_empty_tiles:
-                                print('Removing empty raster file: ' + Handler(out_file_name).basename)
-                                Handler(out_file_name).file_delete()
-                                print('')
-
-                            # unassign
-                            out_raster = None
+                            tiles.append((i, j, tsx, tsy, out_file_name, new_transform))
+
+                nworkers = max(1, min(max_workers, os.cpu_count() or 1, len(tiles)))
+
+                # each worker writes every nworkers-th tile using its own input file handle
+                with ThreadPoolExecutor(max_workers=nworkers) as executor:
+                    list(executor.map(lambda worker_tiles: self._write_tiles(in_file,
+                                                                             worker_tiles,
+                                                                             band_names,
+                                                                             dtype,
+                                                                             crs_string),
+                                      list(tiles[w::nworkers] for w in range(nworkers))))
             else:
                 raise AttributeError("Metadata dictionary does not exist.")
         else:
@@ -512,25 +1269,91 @@ class Raster(object):
                                                                                             self.shape[1],
                                                                                             self.shape[2]))
 
+    @staticmethod
+    def _write_tiles(in_file,
+                     tiles,
+                     band_names,
+                     dtype,
+                     crs_string):
+        """
+        Write a list of tiles from make_tiles to their files
+        :param in_file: Input raster file
+        :param tiles: List of (x offset, y offset, x size, y size, output file, geotransform) tuples
+        :param band_names: List of band descriptions
+        :param dtype: GDAL data type
+        :param crs_string: Projection WKT
+        :return: None
+        """
+        if len(tiles) == 0:
+            return
+
+        # GDAL datasets can not be shared between threads
+        in_file_ptr = gdal.Open(in_file)
+        driver = _GTIFF_DRIVER
+
+        bands = len(band_names)
+        band_list = list(range(1, bands + 1))
+
+        # one buffer for all tiles, edge tiles use a view on the front of it
+        tile_buf = np.empty(bands * max(tile[2] * tile[3] for tile in tiles),
+                            dtype=gdal_array.GDALTypeCodeToNumericTypeCode(dtype))
+
+        # integer tiles always have finite values
+        check_finite = tile_buf.dtype.kind in 'fc'
+
+        for i, j, tile_size_x, tile_size_y, out_file_name, new_transform in tiles:
+
+            # read all bands of the tile in one call
+            tile_arr = tile_buf[:bands * tile_size_y * tile_size_x].reshape(bands,
+                                                                           tile_size_y,
+                                                                           tile_size_x)
+            in_file_ptr.ReadAsArray(i, j, tile_size_x, tile_size_y,
+                                    buf_obj=tile_arr,
+                                    band_list=band_list)
+
+            # skip tiles with an empty band (only non-finite values) before creating the file
+            if check_finite and any(not np.isfinite(band_arr).any() for band_arr in tile_arr):
+                print('Skipping empty raster tile: ' + Handler(out_file_name).basename)
+                continue
+
+            # initiate output file and write all bands in one call
+            out_file_ptr = driver.Create(out_file_name, tile_size_x, tile_size_y, bands, dtype)
+            out_file_ptr.WriteRaster(0, 0, tile_size_x, tile_size_y, tile_arr,
+                                     buf_type=dtype,
+                                     band_list=band_list)
+
+            for k, band_name in enumerate(band_names):
+                out_file_ptr.GetRasterBand(k + 1).SetDescription(band_name)
+
+            # set spatial reference and projection parameters
+            out_file_ptr.SetGeoTransform(new_transform)
+            out_file_ptr.SetProjection(crs_string)
+
+            # delete pointers
+            out_file_ptr.FlushCache()  # save to disk
+            out_file_ptr = None
+
+        in_file_ptr = None
+
     @staticmethod
     def get_raster_metadict(file_name=None,
                             file_ptr=None):
         """
         Function to get all the spatial metadata associated with a geotiff raster
         :param file_name: Name of the raster file (includes full path)
-        :param file_ptr: Gdal file pointer
+        :param file_ptr: Gdal file pointer (used instead of opening file_name if both are given)
         :return: Dictionary of raster metadata
         """
-        if file_name is not None:
+        if file_ptr is not None:
+            img_pointer = file_ptr
+
+        elif file_name is not None:
             if Handler(file_name).file_exists():
                 # open raster
                 img_pointer = gdal.Open(file_name)
             else:
                 raise ValueError("File does not exist.")
 
-        elif file_ptr is not None:
-            img_pointer = file_ptr
-
         else:
             raise ValueError("File or pointer not found")
 
@@ -557,18 +1380,45 @@ class Raster(object):
         return meta_dict
 
     def change_type(self,
-                    out_type='int16'):
+                    out_type='int16',
+                    outfile=None):
 
         """
         Method to change the raster data type
         :param out_type: Out data type. Options: int, int8, int16, int32, int64,
                                                 float, float, float32, float64,
                                                 uint, uint8, uint16, uint32, etc.
+        :param outfile: output file name. If the raster array is not read,
+                        the file is converted block by block and written to outfile
         :return: None
         """
-        if gdal_array.NumericTypeCodeToGDALTypeCode(np.dtype(out_type)) != self.dtype:
+        if self.array is None and outfile is not None:
+            if not self.init:
+                self.initialize()
+
+            nodatavalue = self.nodatavalue
+            if nodatavalue is not None:
+                nodatavalue = np.array(nodatavalue).astype(out_type).item()
+
+            out_raster = self._create_like(outfile,
+                                           gdal_array.NumericTypeCodeToGDALTypeCode(np.dtype(out_type)),
+                                           nodatavalue)
+            self.apply_over_blocks(lambda block_arr: block_arr.astype(out_type, copy=False),
+                                   dst=out_raster)
+            out_raster.datasource = None
+
+            print('Written {} with data type {}\n'.format(outfile, out_type))
+
+        elif gdal_array.NumericTypeCodeToGDALTypeCode(np.dtype(out_type)) != self.dtype:
+
+            in_dtype, out_dtype = self.array.dtype, np.dtype(out_type)
+
+            # integer to integer of the same size keeps the same bits, reinterpret without copy
+            if in_dtype.kind in 'iu' and out_dtype.kind in 'iu' and in_dtype.itemsize == out_dtype.itemsize:
+                self.array = self.array.view(out_dtype)
+            else:
+                self.array = self.array.astype(out_dtype, copy=False)
 
-            self.array = self.array.astype(out_type)
             self.dtype = gdal_array.NumericTypeCodeToGDALTypeCode(self.array.dtype)
 
             if self.nodatavalue is not None:
@@ -580,30 +1430,64 @@ class Raster(object):
 
     def make_polygon_geojson_feature(self):
         """
-        Make a feature geojson for the raster using its metaDict data
-        """
-
-        meta_dict = self.metadict
-
-        if meta_dict is not None:
-            return {"type": "Feature",
-                    "geometry": {
-                        "type": "Polygon",
-                        "coordinates": [[
-                             [meta_dict['ulx'], meta_dict['uly']],
-                             [meta_dict['ulx'], meta_dict['uly'] - (meta_dict['ypixel'] * (meta_dict['rows'] + 1))],
-                             [meta_dict['ulx'] + (meta_dict['xpixel'] * (meta_dict['columns'] + 1)),
-                              meta_dict['uly'] - (meta_dict['ypixel'] * (meta_dict['rows'] + 1))],
-                             [meta_dict['ulx'] + (meta_dict['xpixel'] * (meta_dict['columns'] + 1)), meta_dict['uly']],
-                             [meta_dict['ulx'], meta_dict['uly']]
-                             ]]
-                        },
-                    "properties": {
-                        "name": meta_dict['name'].split('.')[0]
-                        },
-                    }
+        Make a feature geojson for the raster using its metaDict data,
+        or the file header if the metaDict is not available
+        """
+
+        if self.metadict is not None:
+            meta_dict = self.metadict
         else:
-            raise AttributeError("Metadata dictionary does not exist.")
+            self._ensure_geo()
+            meta_dict = {'ulx': self.ulx,
+                         'uly': self.uly,
+                         'xpixel': self.xpixel,
+                         'ypixel': self.ypixel,
+                         'rows': self.shape[1],
+                         'columns': self.shape[2],
+                         'name': Handler(self.name).basename}
+
+        return {"type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[
+                         [meta_dict['ulx'], meta_dict['uly']],
+                         [meta_dict['ulx'], meta_dict['uly'] - (meta_dict['ypixel'] * (meta_dict['rows'] + 1))],
+                         [meta_dict['ulx'] + (meta_dict['xpixel'] * (meta_dict['columns'] + 1)),
+                          meta_dict['uly'] - (meta_dict['ypixel'] * (meta_dict['rows'] + 1))],
+                         [meta_dict['ulx'] + (meta_dict['xpixel'] * (meta_dict['columns'] + 1)), meta_dict['uly']],
+                         [meta_dict['ulx'], meta_dict['uly']]
+                         ]]
+                    },
+                "properties": {
+                    "name": meta_dict['name'].split('.')[0]
+                    },
+                }
+
+    def _ensure_geo(self):
+        """
+        Make sure the geotransform, shape, tie point and pixel size are available.
+        Only the dataset header is read if they are missing, the raster is not initialized
+        :return: None
+        """
+        if self.transform is None or self.shape is None:
+            if self.datasource is not None:
+                fileptr = self.datasource
+            elif Handler(self.name).file_exists() or 'vsimem' in self.name:
+                fileptr = gdal.Open(self.name)
+            else:
+                raise ValueError('No datasource found')
+
+            if self.transform is None:
+                self.transform = fileptr.GetGeoTransform()
+
+            if self.shape is None:
+                self.shape = [fileptr.RasterCount, fileptr.RasterYSize, fileptr.RasterXSize]
+
+            fileptr = None
+
+        if self.ulx is None:
+            self.ulx, self.uly = float(self.transform[0]), float(self.transform[3])
+            self.xpixel, self.ypixel = abs(float(self.transform[1])), abs(float(self.transform[5]))
 
     @staticmethod
     def get_coords(xy_list,
@@ -616,20 +1500,21 @@ class Raster(object):
         :param pixel_size: tuple of x and y pixel size. The signs of the pixel sizes (+/-) are as in GeoTransform
         :param tie_point: tuple of x an y coordinates of tie point for the xy list
         :param pixel_center: If the center of the pixels should be returned instead of the top corners (default: True)
-        :return: List of coordinates in tie point coordinate system
+        :return: List of coordinates in tie point coordinate system [[x1, y1], [x2, y2]....]
         """
 
-        if type(xy_list) != list:
+        if type(xy_list) not in (list, np.ndarray):
             xy_list = [xy_list]
 
+        pixel_size = np.array(pixel_size, dtype=np.float64)
+
+        coords = np.asarray(xy_list, dtype=np.float64).reshape(-1, 2) * pixel_size + \
+            np.array(tie_point, dtype=np.float64)
+
         if pixel_center:
-            add_const = (float(pixel_size[0])/2.0, float(pixel_size[1])/2.0)
-        else:
-            add_const = (0.0, 0.0)
+            coords += pixel_size / 2.0
 
-        return list((float(xy[0]) * float(pixel_size[0]) + tie_point[0] + add_const[0],
-                     float(xy[1]) * float(pixel_size[1]) + tie_point[1] + add_const[1])
-                    for xy in xy_list)
+        return coords.tolist()
 
     @staticmethod
     def get_locations(coords_list,
@@ -640,15 +1525,27 @@ class Raster(object):
         :param coords_list: Lit of coordinates in image CRS [(x1,y1), (x2,y2)....]
         :param pixel_size: Pixel size
         :param tie_point: Tie point of the raster or tile
-        :return: list of pixel locations
+        :return: list of pixel locations [[x1, y1], [x2, y2]....], [None, None] for None coordinates
         """
-        if type(coords_list) != list:
+        if type(coords_list) not in (list, np.ndarray):
             coords_list = [coords_list]
 
-        return list(((coord[0] - tie_point[0])//pixel_size[0],
-                     (coord[1] - tie_point[1])//pixel_size[1])
-                    if coord is not None else [None, None]
-                    for coord in coords_list)
+        if type(coords_list) == np.ndarray or all(coord is not None for coord in coords_list):
+            return ((np.asarray(coords_list, dtype=np.float64).reshape(-1, 2) - np.array(tie_point, dtype=np.float64))
+                    // np.array(pixel_size, dtype=np.float64)).tolist()
+
+        # locations of the coordinates that are not None
+        valid = list(ii for ii, coord in enumerate(coords_list) if coord is not None)
+        locations = list([None, None] for _ in coords_list)
+
+        if len(valid) > 0:
+            valid_locations = Raster.get_locations(list(coords_list[ii] for ii in valid),
+                                                   pixel_size,
+                                                   tie_point)
+            for ii, location in zip(valid, valid_locations):
+                locations[ii] = location
+
+        return locations
 
     def get_bounds(self,
                    xy_coordinates=True):
@@ -657,20 +1554,20 @@ class Raster(object):
         :param xy_coordinates: return a list of xy coordinates if true, else return [xmin, xmax, ymin, ymax]
         :return: List of lists
         """
-        if not self.init:
-            self.initialize()
-        tie_pt = [self.transform[0], self.transform[3]]
+        self._ensure_geo()
+        tie_pt = [self.ulx, self.uly]
+
+        xmax = self.ulx + self.xpixel * self.shape[2]
+        ymin = self.uly - self.ypixel * self.shape[1]
 
         if xy_coordinates:
             return [tie_pt,
-                    [tie_pt[0] + self.metadict['xpixel'] * self.shape[2], tie_pt[1]],
-                    [tie_pt[0] + self.metadict['xpixel'] * self.shape[2],
-                     tie_pt[1] - self.metadict['ypixel'] * self.shape[1]],
-                    [tie_pt[0], tie_pt[1] - self.metadict['ypixel'] * self.shape[1]],
+                    [xmax, self.uly],
+                    [xmax, ymin],
+                    [self.ulx, ymin],
                     tie_pt]
         else:
-            return [tie_pt[0], tie_pt[0] + self.metadict['xpixel'] * self.shape[2],
-                    tie_pt[1] - self.metadict['ypixel'] * self.shape[1], tie_pt[1]]
+            return [self.ulx, xmax, ymin, self.uly]
 
     def get_pixel_bounds(self,
                          bound_coords=None,
@@ -682,34 +1579,28 @@ class Raster(object):
                                                                            'crs' for image reference system coordinates
         :return: tuple: (xmin, xmax, ymin, ymax) in pixel coordinates
         """
-        if not self.init:
-            self.initialize()
+        self._ensure_geo()
 
         if bound_coords is not None:
             if coords_type == 'pixel':
                 xmin, xmax, ymin, ymax = bound_coords
             elif coords_type == 'crs':
                 _xmin, _xmax, _ymin, _ymax = bound_coords
-                coords_list = [(_xmin, _ymax), (_xmax, _ymax), (_xmax, _ymin), (_xmin, _ymin)]
-                coords_locations = np.array(self.get_locations(coords_list,
-                                                               (self.transform[1], self.transform[5]),
-                                                               (self.transform[0], self.transform[3])))
-                xmin, xmax, ymin, ymax = \
-                    int(coords_locations[:, 0].min()), \
-                    int(coords_locations[:, 0].max()), \
-                    int(coords_locations[:, 1].min()), \
-                    int(coords_locations[:, 1].max())
+
+                # pixel locations of the four corners
+                coords_locations = (np.array([[_xmin, _ymax], [_xmax, _ymax], [_xmax, _ymin], [_xmin, _ymin]],
+                                             dtype=np.float64) -
+                                    np.array([self.transform[0], self.transform[3]])) // \
+                    np.array([self.transform[1], self.transform[5]])
+
+                (xmin, ymin), (xmax, ymax) = coords_locations.min(axis=0), coords_locations.max(axis=0)
             else:
                 raise ValueError("Unknown coordinate types")
 
-            if xmin < 0:
-                xmin = 0
-            if xmax > self.shape[2]:
-                xmax = self.shape[2]
-            if ymin < 0:
-                ymin = 0
-            if ymax > self.shape[1]:
-                ymax = self.shape[1]
+            # clip to raster extent
+            (xmin, ymin), (xmax, ymax) = np.clip([[xmin, ymin], [xmax, ymax]],
+                                                 0,
+                                                 [self.shape[2], self.shape[1]]).astype(np.int64).tolist()
 
             if xmin >= xmax:
                 raise ValueError("Image x-size should be greater than 0")
@@ -736,62 +1627,185 @@ class Raster(object):
         :param tile_buffer: Buffer outside the tile boundary in image projection units
         :return: list of lists
         """
-        if not self.init:
-            self.initialize()
+        self._ensure_geo()
 
         # convert to the number of pixels in the buffer region
         if tile_buffer is not None:
-            buf_size_x = np.ceil(float(tile_buffer)/abs(float(self.transform[1])))
-            buf_size_y = np.ceil(float(tile_buffer)/abs(float(self.transform[5])))
+            buf_size_x = np.ceil(float(tile_buffer) / self.xpixel)
+            buf_size_y = np.ceil(float(tile_buffer) / self.ypixel)
         else:
             buf_size_x = buf_size_y = None
 
         xmin, xmax, ymin, ymax = self.get_pixel_bounds(bound_coords,
                                                        coords_type)
 
-        for y in range(ymin, ymax, tile_ysize):
+        # tile origins and sizes, edge tiles are smaller
+        tile_y = np.arange(ymin, ymax, tile_ysize)
+        tile_x = np.arange(xmin, xmax, tile_xsize)
+        tile_rows = np.minimum(tile_ysize, ymax - tile_y)
+        tile_cols = np.minimum(tile_xsize, xmax - tile_x)
 
-            if y + tile_ysize < ymax:
-                rows = tile_ysize
-            else:
-                rows = ymax - y
+        # row-major grid of all tiles
+        grid_x, grid_y = np.meshgrid(tile_x, tile_y)
+        grid_cols, grid_rows = np.meshgrid(tile_cols, tile_rows)
 
-            for x in range(xmin, xmax, tile_xsize):
-                if x + tile_xsize < xmax:
-                    cols = tile_xsize
-                else:
-                    cols = xmax - x
+        self.tile_block_coords = np.stack([grid_x.ravel(),
+                                           grid_y.ravel(),
+                                           grid_cols.ravel(),
+                                           grid_rows.ravel()], axis=1).astype(np.int64)
+
+        # tie points of all tiles
+        self.tile_tie_points = np.stack([grid_x.ravel() * float(self.transform[1]) + float(self.transform[0]),
+                                         grid_y.ravel() * float(self.transform[5]) + float(self.transform[3])],
+                                        axis=1)
+
+        # corners opposite the tie points
+        self.tile_end_points = self.tile_tie_points + \
+            self.tile_block_coords[:, 2:4] * np.array([self.transform[1], self.transform[5]], dtype=np.float64)
+
+        self.ntiles = self.tile_block_coords.shape[0]
+        self._tile_first_pixel = (xmin, ymin)
+        self._tile_grid = None
+
+    def tile_bound_coords(self,
+                          tile_index):
+        """
+        Method to get the corner coordinates of a tile from the tile grid
+        :param tile_index: Index of the tile in the tile grid
+        :return: List of 5 [x, y] coordinates (closed polygon ring)
+        """
+        tie_x, tie_y = self.tile_tie_points[tile_index].tolist()
+        end_x, end_y = self.tile_end_points[tile_index].tolist()
+
+        return [[tie_x, tie_y], [end_x, tie_y], [end_x, end_y], [tie_x, end_y], [tie_x, tie_y]]
 
-                tie_pt = self.get_coords([(x, y)],
-                                         (self.transform[1], self.transform[5]),
-                                         (self.transform[0], self.transform[3]),
-                                         pixel_center=False)[0]
+    def envelope_pixel_bounds(self,
+                              envelopes):
+        """
+        Method to convert envelopes in image CRS to the pixels containing their corners
+        :param envelopes: numpy array of envelopes (N x 4) as (xmin, xmax, ymin, ymax)
+        :return: numpy array (N x 4) of (first column, last column, first row, last row)
+        """
+        self._ensure_geo()
 
-                bounds = [tie_pt,
-                          [tie_pt[0] + self.transform[1] * cols, tie_pt[1]],
-                          [tie_pt[0] + self.transform[1] * cols, tie_pt[1] + self.transform[5] * rows],
-                          [tie_pt[0], tie_pt[1] + self.transform[5] * rows],
-                          tie_pt]
+        envelopes = np.asarray(envelopes, dtype=np.float64).reshape(-1, 4)
 
-                self.tile_grid.append({'block_coords': (x, y, cols, rows),
-                                       'tie_point': tie_pt,
-                                       'bound_coords': bounds,
-                                       'first_pixel': (xmin, ymin)})
+        # envelope corners in pixel coordinates, in either order of the pixel size signs
+        px = np.floor((envelopes[:, 0:2] - self.transform[0]) / self.transform[1])
+        py = np.floor((envelopes[:, 2:4] - self.transform[3]) / self.transform[5])
 
-        self.ntiles = len(self.tile_grid)
+        return np.column_stack((px.min(axis=1), px.max(axis=1),
+                                py.min(axis=1), py.max(axis=1)))
+
+    def tile_envelope_index(self,
+                            envelopes):
+        """
+        Method to find the tiles of the tile grid that each envelope may overlap.
+        The tile grid is regular, so the tile ranges are found by a binary search
+        on the tile origins instead of testing every tile against every envelope
+        :param envelopes: numpy array of envelopes (N x 4) in image CRS,
+                          each as (xmin, xmax, ymin, ymax) as returned by OGR GetEnvelope()
+        :return: dict of tile index : list of envelope indices
+        """
+        tile_index = dict()
+
+        if self.ntiles is None or self.ntiles == 0:
+            return tile_index
+
+        envelopes = np.asarray(envelopes, dtype=np.float64).reshape(-1, 4)
+
+        # tile origins and pixel extent of the grid
+        tile_x = np.unique(self.tile_block_coords[:, 0])
+        tile_y = np.unique(self.tile_block_coords[:, 1])
+        grid_xmax = int((self.tile_block_coords[:, 0] + self.tile_block_coords[:, 2]).max())
+        grid_ymax = int((self.tile_block_coords[:, 1] + self.tile_block_coords[:, 3]).max())
+
+        px_min, px_max, py_min, py_max = self.envelope_pixel_bounds(envelopes).T
+
+        inside = (px_max >= tile_x[0]) & (px_min < grid_xmax) & \
+                 (py_max >= tile_y[0]) & (py_min < grid_ymax)
+
+        # first and last tile column and row of each envelope
+        ix0 = np.searchsorted(tile_x, np.clip(px_min, tile_x[0], None), side='right') - 1
+        ix1 = np.searchsorted(tile_x, np.clip(px_max, None, grid_xmax - 1), side='right') - 1
+        iy0 = np.searchsorted(tile_y, np.clip(py_min, tile_y[0], None), side='right') - 1
+        iy1 = np.searchsorted(tile_y, np.clip(py_max, None, grid_ymax - 1), side='right') - 1
+
+        ntiles_x = tile_x.shape[0]
+
+        env_indices = np.flatnonzero(inside)
+        if env_indices.shape[0] == 0:
+            return tile_index
+
+        # one (tile, envelope) pair per tile in the column and row range of each envelope
+        range_x = (ix1 - ix0 + 1)[env_indices]
+        counts = range_x * (iy1 - iy0 + 1)[env_indices]
+
+        pair_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_range_x = np.repeat(range_x, counts)
+
+        pair_tiles = (np.repeat(iy0[env_indices], counts) + pair_offsets // pair_range_x) * ntiles_x + \
+            np.repeat(ix0[env_indices], counts) + pair_offsets % pair_range_x
+        pair_envs = np.repeat(env_indices, counts)
+
+        # group the pairs by tile, keeping envelopes in input order
+        sort_order = np.argsort(pair_tiles, kind='stable')
+        pair_tiles = pair_tiles[sort_order]
+        pair_envs = pair_envs[sort_order]
+
+        tiles, first = np.unique(pair_tiles, return_index=True)
+
+        for tile, envs in zip(tiles.tolist(), np.split(pair_envs, first[1:])):
+            tile_index[tile] = envs.tolist()
+
+        return tile_index
+
+    @property
+    def tile_grid(self):
+        """
+        List of tile dictionaries with keys 'block_coords', 'tie_point', 'bound_coords', 'first_pixel'
+        built from tile_block_coords and tile_tie_points on first access
+        :return: list of dicts
+        """
+        if self._tile_grid is None:
+            self._tile_grid = list()
+
+            if self.ntiles is not None:
+                tie_x, tie_y = self.tile_tie_points[:, 0], self.tile_tie_points[:, 1]
+                end_x, end_y = self.tile_end_points[:, 0], self.tile_end_points[:, 1]
+
+                # closed rings of all tiles (ntiles x 5 x 2)
+                bound_coords = np.stack([np.stack([tie_x, end_x, end_x, tie_x, tie_x], axis=1),
+                                         np.stack([tie_y, tie_y, end_y, end_y, tie_y], axis=1)],
+                                        axis=2).tolist()
+
+                for block_coords, tie_point, tile_bounds in zip(self.tile_block_coords.tolist(),
+                                                                self.tile_tie_points.tolist(),
+                                                                bound_coords):
+                    self._tile_grid.append({'block_coords': tuple(block_coords),
+                                            'tie_point': tie_point,
+                                            'bound_coords': tile_bounds,
+                                            'first_pixel': self._tile_first_pixel})
+
+        return self._tile_grid
 
     def get_tile(self,
                  bands=None,
                  block_coords=None,
                  finite_only=True,
                  edge_buffer=0,
-                 nan_replacement=None):
+                 nan_replacement=None,
+                 buf=None,
+                 fileptr=None):
         """
         Method to get raster numpy array of a tile
         :param bands: bands to get in the array, index starts from one. (default: all)
         :param finite_only:  If only finite values should be returned
         :param edge_buffer: Number of extra pixels to retrieve further out from the edges (default: 0)
         :param nan_replacement: replacement for NAN values
+        :param buf: 1d numpy array of the raster data type, large enough for the tile, to read the tile into.
+                    The returned array is then a view on the front of this buffer (default: None, new array)
+        :param fileptr: GDAL dataset to read the tile from (default: None, the raster datasource)
         :param block_coords: coordinates of tile to retrieve in image/array coords
                              format is (upperleft_x, upperleft_y, tile_cols, tile_rows)
                              upperleft_x and upperleft_y are array coordinates starting at 0,
@@ -845,45 +1859,77 @@ class Raster(object):
                             tile_rows + (2 * edge_buffer - pixel_deficit[1] + pixel_deficit[3]),
                             tile_cols + (2 * edge_buffer - pixel_deficit[0] + pixel_deficit[2])]
 
+        # fall back to a new array if the buffer is too small
+        if buf is not None and buf.size < len(bands) * new_block_coords[2] * new_block_coords[3]:
+            buf = None
+
+        if fileptr is None:
+            fileptr = self.datasource
+
         if len(bands) == 1:
-            temp_band = self.datasource.GetRasterBand(bands[0])
-            tile_arr = temp_band.ReadAsArray(*new_block_coords)
+            temp_band = fileptr.GetRasterBand(bands[0])
+
+            if buf is None:
+                tile_arr = temp_band.ReadAsArray(*new_block_coords)
+            else:
+                tile_arr = buf[:new_block_coords[3] * new_block_coords[2]].reshape(new_block_coords[3],
+                                                                                   new_block_coords[2])
+                temp_band.ReadAsArray(*new_block_coords,
+                                      buf_obj=tile_arr)
 
         else:
-            tile_arr = np.zeros((len(bands),
-                                 new_block_coords[3],
-                                 new_block_coords[2]),
-                                gdal_array.GDALTypeCodeToNumericTypeCode(self.dtype))
+            tile_shape = (len(bands), new_block_coords[3], new_block_coords[2])
 
-            for jj, band in enumerate(bands):
-                temp_band = self.datasource.GetRasterBand(band)
-                tile_arr[jj, :, :] = temp_band.ReadAsArray(*new_block_coords)
+            if buf is None:
+                tile_arr = np.empty(tile_shape, self._np_dtype)
+            else:
+                tile_arr = buf[:tile_shape[0] * tile_shape[1] * tile_shape[2]].reshape(tile_shape)
+
+            # read all bands in one call, letting GDAL decode blocks of all bands together
+            fileptr.ReadAsArray(*new_block_coords,
+                                buf_obj=tile_arr,
+                                band_list=list(bands))
 
-            if finite_only:
-                if np.isnan(tile_arr).any() or np.isinf(tile_arr).any():
-                    tile_arr[np.isnan(tile_arr)] = nan_replacement
-                    tile_arr[np.isinf(tile_arr)] = nan_replacement
+        if finite_only and tile_arr.dtype.kind in 'fc':
+            np.nan_to_num(tile_arr,
+                          copy=False,
+                          nan=nan_replacement,
+                          posinf=nan_replacement,
+                          neginf=nan_replacement)
 
         return tile_arr
 
     def get_next_tile(self,
-                      tile_xsize=1024,
-                      tile_ysize=1024,
+                      tile_xsize=None,
+                      tile_ysize=None,
                       bands=None,
                       get_array=True,
                       finite_only=True,
                       edge_buffer=0,
-                      nan_replacement=None):
+                      nan_replacement=None,
+                      reuse_buffer=False,
+                      prefetch=0):
 
         """
         Generator to extract raster tile by tile
         :param tile_xsize: Number of columns in the tile block
         :param tile_ysize: Number of rows in the tile block
+                           Tile sizes that are multiples of the raster block size (self.block_size)
+                           decode each block only once. The default is 1024, rounded down to a multiple
+                           of the block size when the block is smaller
         :param bands: List of bands to extract (default: None, gets all bands; Index starts at 0)
         :param get_array: If raster array should be retrieved as well
         :param finite_only: If only finite values should be returned
         :param edge_buffer: Number of extra pixels to retrieve further out from the edges (default: 0)
         :param nan_replacement: replacement for NAN values
+        :param reuse_buffer: If all tiles should be read into one buffer (default: False).
+                             Each yielded array is then a view overwritten by the next tile,
+                             use only when each tile is consumed before the next one is requested
+        :param prefetch: Number of tiles read ahead in background threads while the current tile is used
+                         (default: 0, each tile is read when it is requested).
+                         Each thread opens its own read-only handle on the file at self.name, not self.datasource,
+                         so tiles come from the file as stored on disk or in /vsimem/. Do not use this for
+                         unflushed writes or a datasource that is not the file at self.name
         :return: Yields tuple: (tiepoint xy tuple, tile numpy array(2d array if only one band, else 3d array)
         """
 
@@ -891,8 +1937,27 @@ class Raster(object):
             self.initialize()
 
         if self.ntiles is None:
+            block_xsize, block_ysize = self.block_size
+            explicit_size = tile_xsize is not None or tile_ysize is not None
+
+            if tile_xsize is None:
+                tile_xsize = (1024 // block_xsize) * block_xsize if block_xsize <= 1024 else 1024
+            if tile_ysize is None:
+                tile_ysize = (1024 // block_ysize) * block_ysize if block_ysize <= 1024 else 1024
+
+            # tiles cutting through blocks decode those blocks for each tile
+            if explicit_size and \
+                    ((tile_xsize % block_xsize != 0 and tile_xsize < self.shape[2]) or
+                     (tile_ysize % block_ysize != 0 and tile_ysize < self.shape[1])):
+                warnings.warn('Tile size ({}, {}) is not a multiple of the raster block size ({}, {}), '
+                              'blocks on tile edges are read more than once'.format(tile_xsize,
+                                                                                   tile_ysize,
+                                                                                   block_xsize,
+                                                                                   block_ysize))
+
             self.make_tile_grid(tile_xsize,
                                 tile_ysize)
+
         if nan_replacement is None:
             if self.nodatavalue is None:
                 nan_replacement = 0
@@ -911,20 +1976,74 @@ class Raster(object):
         else:
             raise ValueError('Unknown/unsupported data type for "bands" keyword')
 
-        tile_counter = 0
-        while tile_counter < self.ntiles:
-            if get_array:
-                tile_arr = self.get_tile(bands=bands,
-                                         block_coords=self.tile_grid[tile_counter]['block_coords'],
-                                         finite_only=finite_only,
-                                         edge_buffer=edge_buffer,
-                                         nan_replacement=nan_replacement)
-            else:
-                tile_arr = None
+        # tiles are read ahead only from files each thread can open
+        if not (get_array and prefetch > 0 and self.ntiles > 1 and
+                (Handler(self.name).file_exists() or 'vsimem' in self.name)):
+            prefetch = 0
+
+        # one buffer for the largest tile including edge buffer, smaller tiles use a view on its front.
+        # With prefetch, a ring of buffers: the yielded tile's buffer is only refilled after the next request
+        if get_array and reuse_buffer and self.ntiles > 0:
+            max_cols, max_rows = self.tile_block_coords[:, 2:].max(axis=0).tolist()
+            tile_bufs = list(np.empty(len(bands) * (max_cols + 2 * edge_buffer) * (max_rows + 2 * edge_buffer),
+                                      self._np_dtype)
+                             for _ in range(prefetch + 1))
+        else:
+            tile_bufs = [None] * (prefetch + 1)
+
+        if prefetch == 0:
+            tile_counter = 0
+            while tile_counter < self.ntiles:
+                if get_array:
+                    tile_arr = self.get_tile(bands=bands,
+                                             block_coords=tuple(self.tile_block_coords[tile_counter].tolist()),
+                                             finite_only=finite_only,
+                                             edge_buffer=edge_buffer,
+                                             nan_replacement=nan_replacement,
+                                             buf=tile_bufs[0])
+                else:
+                    tile_arr = None
+
+                yield self.tile_tie_points[tile_counter].tolist(), tile_arr
 
-            yield self.tile_grid[tile_counter]['tie_point'], tile_arr
+                tile_counter += 1
 
-            tile_counter += 1
+        else:
+            thread_data = threading.local()
+            fileptrs = list()
+
+            def read_tile(tile_index):
+                # GDAL datasets cannot be shared between threads
+                if not hasattr(thread_data, 'fileptr'):
+                    thread_data.fileptr = gdal.Open(self.name)
+                    fileptrs.append(thread_data.fileptr)
+
+                return self.get_tile(bands=bands,
+                                     block_coords=tuple(self.tile_block_coords[tile_index].tolist()),
+                                     finite_only=finite_only,
+                                     edge_buffer=edge_buffer,
+                                     nan_replacement=nan_replacement,
+                                     buf=tile_bufs[tile_index % (prefetch + 1)],
+                                     fileptr=thread_data.fileptr)
+
+            executor = ThreadPoolExecutor(max_workers=prefetch)
+            try:
+                pending = deque(executor.submit(read_tile, tile_index)
+                                for tile_index in range(min(prefetch, self.ntiles)))
+
+                for tile_counter in range(self.ntiles):
+                    tile_arr = pending.popleft().result()
+
+                    if tile_counter + prefetch < self.ntiles:
+                        pending.append(executor.submit(read_tile, tile_counter + prefetch))
+
+                    yield self.tile_tie_points[tile_counter].tolist(), tile_arr
+            finally:
+                executor.shutdown(wait=True)
+
+                # close the per-thread dataset handles, the worker threads have exited
+                del fileptrs[:]
+                thread_data = None
 
     def extract_geom(self,
                      wkt_strings,
@@ -962,54 +2081,33 @@ class Raster(object):
                 {internal_id: {'values': [[band1, ], ], 'coordinates': [(x1, y1), ]}, }
                 if geom_id is supplied then internal_id is the supplied geom_id
         """
+        # initialize raster
+        if not self.init:
+            self.initialize()
+
+        # define band order
         if band_order is None:
             band_order = list(range(self.shape[0]))
 
-        # define tile size
-        if 'tile_size' in kwargs:
-            tile_size = kwargs['tile_size']
-        else:
-            tile_size = (self.shape[1], self.shape[2])
+        # define tile size (columns, rows)
+        tile_size = kwargs.get('tile_size', (self.shape[2], self.shape[1]))
 
         # if multi geometries should be separated or not
-        if 'multi_geom_separate' in kwargs:
-            multi_geom_separate = kwargs['multi_geom_separate']
-        else:
-            multi_geom_separate = False
-
-        if 'pass_pixel_coords' in kwargs:
-            pass_pixel_coords = kwargs['pass_pixel_coords']
-        else:
-            pass_pixel_coords = False
+        multi_geom_separate = kwargs.get('multi_geom_separate', False)
 
-        if 'pixel_center' in kwargs:
-            pixel_center = kwargs['pixel_center']
-        else:
-            pixel_center = True
-
-        if 'reducer' in kwargs:
-            reducer = kwargs['reducer']
-        else:
-            reducer = None
-
-        # define band order
-        if band_order is None:
-            band_order = list(range(0, self.shape[0]))
-
-        # initialize raster
-        if not self.init or self.array is None:
-            self.initialize()
+        pass_pixel_coords = kwargs.get('pass_pixel_coords', False)
+        pixel_center = kwargs.get('pixel_center', True)
+        reducer = kwargs.get('reducer')
 
         # make wkt strings into a list
         if type(wkt_strings) not in (list, tuple):
             wkt_strings = [wkt_strings]
 
         # list of geometry indices and OGR SWIG geometry objects
-        # each dict entry contains   internal_id : (geom_id, geom)
+        # each dict entry contains   internal_id : geom
         id_geom_dict = dict()
-        geom_types = []
 
-        for wkt_string_indx, wkt_string in enumerate(range(len(wkt_strings))):
+        for wkt_string_indx, wkt_string in enumerate(wkt_strings):
             # multi geometry should be separated
             if multi_geom_separate:
                 if ('MULTI' in wkt_string) or ('multi' in wkt_string):
@@ -1022,7 +2120,9 @@ class Raster(object):
                         geom_internal_id = '{}_{}'.format(str(wkt_string_indx), str(multi_geom_indx))\
                             if geom_id is None else '{}_{}'.format(str(geom_id[wkt_string_indx]),
                                                                    str(multi_geom_indx))
-                        id_geom_dict[geom_internal_id] = multi_geom.GetGeometryRef(multi_geom_indx)
+
+                        # clone the part, the reference is invalid once the parent geometry is freed
+                        id_geom_dict[geom_internal_id] = multi_geom.GetGeometryRef(multi_geom_indx).Clone()
 
                 else:
                     # if no multi geometry in the string
@@ -1037,137 +2137,212 @@ class Raster(object):
         # make internal tiles
         self.make_tile_grid(*tile_size)
 
+        # growing arrays of values and coordinates of each geometry, as [array, rows in use]
+        geom_values = dict((internal_id, [None, 0]) for internal_id in id_geom_dict)
+        geom_coords = dict((internal_id, [None, 0]) for internal_id in id_geom_dict)
+
+        pixel_size = np.array([self.transform[1], self.transform[5]], dtype=np.float64)
+
+        band_order_arr = np.array(band_order, dtype=np.int64)
+
+        # in-memory vector layer for all geometry types, reused by all tiles
+        burn_driver = ogr.GetDriverByName('Memory')
+        burn_datasource = burn_driver.CreateDataSource('mem_source')
+        burn_spref = osr.SpatialReference()
+        burn_spref.ImportFromWkt(self.crs_string)
+        burn_layer = burn_datasource.CreateLayer('tmp_lyr',
+                                                 srs=burn_spref,
+                                                 geom_type=ogr.wkbUnknown)
+
+        # attributes
+        fielddefn = ogr.FieldDefn('fid', ogr.OFTInteger)
+        result = burn_layer.CreateField(fielddefn)
+        layerdef = burn_layer.GetLayerDefn()
+
+        # candidate geometries of each tile from the geometry envelopes
+        geom_ids = list(id_geom_dict.keys())
+        geom_envelopes = np.array(list(id_geom_dict[samp_id].GetEnvelope() for samp_id in geom_ids),
+                                  dtype=np.float64).reshape(-1, 4)
+        tile_geom_index = self.tile_envelope_index(geom_envelopes)
+
+        if shapely is not None:
+            shapely_geoms = shapely.from_wkb(list(bytes(id_geom_dict[samp_id].ExportToWkb())
+                                                  for samp_id in geom_ids))
+        geom_pixel_bounds = self.envelope_pixel_bounds(geom_envelopes)
+
+        # tile envelopes (xmin, xmax, ymin, ymax)
+        tile_envelopes = np.column_stack((np.minimum(self.tile_tie_points[:, 0], self.tile_end_points[:, 0]),
+                                          np.maximum(self.tile_tie_points[:, 0], self.tile_end_points[:, 0]),
+                                          np.minimum(self.tile_tie_points[:, 1], self.tile_end_points[:, 1]),
+                                          np.maximum(self.tile_tie_points[:, 1], self.tile_end_points[:, 1])))
+
+        # list of sample ids
+        for tile_index in sorted(tile_geom_index):
+            tile_env = tile_envelopes[tile_index]
+
+            # candidate geometries whose envelopes overlap the tile envelope
+            candidates = np.array(tile_geom_index[tile_index], dtype=np.int64)
+            cand_env = geom_envelopes[candidates]
+
+            overlap = ~((cand_env[:, 1] < tile_env[0]) | (cand_env[:, 0] > tile_env[1]) |
+                        (cand_env[:, 3] < tile_env[2]) | (cand_env[:, 2] > tile_env[3]))
+
+            # envelopes within the tile (including points) intersect the tile,
+            # the exact test is only needed for envelopes crossing the tile edge
+            within = (cand_env[:, 0] >= tile_env[0]) & (cand_env[:, 1] <= tile_env[1]) & \
+                     (cand_env[:, 2] >= tile_env[2]) & (cand_env[:, 3] <= tile_env[3])
+
+            geom_indices = candidates[overlap & within].tolist()
+
+            crossing = candidates[overlap & ~within]
+            if len(crossing) > 0 and shapely is not None:
+                # exact test of all crossing geometries in one GEOS call
+                tile_box = shapely.box(tile_env[0], tile_env[2], tile_env[1], tile_env[3])
+                geom_indices += crossing[shapely.intersects(tile_box, shapely_geoms[crossing])].tolist()
+                geom_indices.sort()
+
+            elif len(crossing) > 0:
+                crossing = crossing.tolist()
+                tile_ring = ogr.Geometry(ogr.wkbLinearRing)
+                for x, y in self.tile_bound_coords(tile_index):
+                    tile_ring.AddPoint_2D(x, y)
+                tile_geom = ogr.Geometry(ogr.wkbPolygon)
+                tile_geom.AddGeometry(tile_ring)
+
+                geom_indices += list(geom_indx for geom_indx in crossing
+                                     if tile_geom.Intersects(id_geom_dict[geom_ids[geom_indx]]))
+                geom_indices.sort()
+
+            # skip reading tiles without any geometries
+            if len(geom_indices) > 0:
+                geom_list = list((geom_ids[geom_indx], id_geom_dict[geom_ids[geom_indx]])
+                                 for geom_indx in geom_indices)
+
+                # restrict the read window to the geometry envelopes within the tile,
+                # with one pixel margin for pixels touched on the envelope edges
+                tile_x, tile_y, tile_cols, tile_rows = self.tile_block_coords[tile_index].tolist()
+                win_bounds = geom_pixel_bounds[geom_indices]
+
+                win_x0 = int(max(tile_x, win_bounds[:, 0].min() - 1))
+                win_x1 = int(min(tile_x + tile_cols, win_bounds[:, 1].max() + 2))
+                win_y0 = int(max(tile_y, win_bounds[:, 2].min() - 1))
+                win_y1 = int(min(tile_y + tile_rows, win_bounds[:, 3].max() + 2))
+
+                block_coords = (win_x0, win_y0, win_x1 - win_x0, win_y1 - win_y0)
+                tie_point = [win_x0 * float(self.transform[1]) + float(self.transform[0]),
+                             win_y0 * float(self.transform[5]) + float(self.transform[3])]
+
+                tile_arr = self.get_tile(block_coords=block_coords)
+
+                # get window shape and tie point
+                _, _, tile_cols, tile_rows = block_coords
+                tie_pt_x, tie_pt_y = tie_point
+
+                # in-memory mask raster of the read window, created empty
+                target_ds = _MEM_DRIVER.Create('tmp',
+                                               tile_cols,
+                                               tile_rows,
+                                               1,
+                                               gdal.GDT_UInt16 if len(geom_list) < 65535 else gdal.GDT_UInt32)
+                target_ds.SetProjection(self.crs_string)
+                target_ds.SetGeoTransform((tie_pt_x,
+                                           self.transform[1],
+                                           0,
+                                           tie_pt_y,
+                                           0,
+                                           self.transform[5]))
+
+                # burn values start at 1 so that 0 stays the background
+                geom_burn_val = 1
+                geom_dict = {}
+                feature_ids = []
+                for geom_id, geom in geom_list:
+                    # create features in layer
+                    temp_feature = ogr.Feature(layerdef)
+                    temp_feature.SetGeometry(geom)
+                    temp_feature.SetField('fid', geom_burn_val)
+                    burn_layer.CreateFeature(temp_feature)
+                    feature_ids.append(temp_feature.GetFID())
+                    geom_dict[geom_burn_val] = geom_id
+                    geom_burn_val += 1
+
+                # burn all geometries of the tile in one call
+                gdal.RasterizeLayer(target_ds,
+                                    [1],
+                                    burn_layer,
+                                    None,  # transformer
+                                    None,  # transform
+                                    [1],
+                                    ['ALL_TOUCHED=TRUE',
+                                     'ATTRIBUTE=FID'])
+
+                # read mask of the window as array
+                mask_arr = target_ds.GetRasterBand(1).ReadAsArray()
+                target_ds = None
+
+                # empty the burn layer for the next tile
+                for feature_id in feature_ids:
+                    burn_layer.DeleteFeature(feature_id)
+
+                # gather burned pixels grouped by burn value, and their band values
+                if tile_arr.ndim == 2:
+                    tile_arr = tile_arr[np.newaxis, :, :]
+
+                starts, pixel_rows, pixel_cols, pixel_values = _gather_by_mask(tile_arr,
+                                                                               mask_arr,
+                                                                               band_order_arr,
+                                                                               geom_burn_val - 1)
+
+                if pass_pixel_coords:
+                    # coordinates of all gathered pixels, pixel locations as (column, row)
+                    pixel_coords = np.column_stack((pixel_cols, pixel_rows)) * pixel_size + \
+                        np.array(tie_point, dtype=np.float64)
+                    if pixel_center:
+                        pixel_coords += pixel_size / 2.0
+
+                for geom_burn_val, geom_id in geom_dict.items():
+                    start, end = int(starts[geom_burn_val]), int(starts[geom_burn_val + 1])
+
+                    if pass_pixel_coords:
+                        _append_rows(geom_coords[geom_id], pixel_coords[start:end])
+
+                    # get band values from tile array
+                    _append_rows(geom_values[geom_id], pixel_values[start:end])
+
+        reducer_func = pctl = None
+        if reducer is not None:
+            reducer_func = _GEOM_REDUCERS.get(reducer)
+
+            if reducer_func is None:
+                pctl_match = _PCTL_RE.match(reducer)
+                if pctl_match is not None:
+                    pctl = int(pctl_match.group(1))
+                else:
+                    warnings.warn('reducer = {} is not implemented'.format(reducer))
+
         # prepare dict struct
         out_geom_extract = dict()
-        for internal_id, _ in id_geom_dict.items():
-            out_geom_extract[internal_id] = {'values': [], 'coordinates': []}
+        for internal_id in id_geom_dict:
+            values = _rows_in_use(geom_values[internal_id], len(band_order), self._np_dtype)
 
-        # list of sample ids
-        for tile in self.tile_grid:
-
-            # create tile geometry from bounds
-            tile_geom = ogr.CreateGeometryFromWkt('POLYGON(({}))'.format(', '.join(list(' '.join([str(x), str(y)])
-                                                                                        for (x, y)
-                                                                                        in tile['bound_coords']))))
-
-            tile_arr = self.get_tile(block_coords=tile['block_coords'])
-
-            # check if the geometry intersects and
-            # place all same geometry types together
-            geom_by_type = {}
-            for samp_id, samp_geom in id_geom_dict.items():
-                if tile_geom.Intersects(samp_geom):
-                    geom_type = samp_geom.GetGeometryType()
-                    if geom_type not in geom_by_type:
-                        geom_by_type[geom_type] = [(samp_id, samp_geom)]
-                    else:
-                        geom_by_type[geom_type].append((samp_id, samp_geom))
-
-            # check is any geoms are available
-            if len(geom_by_type) > 0:
-                for geom_type, geom_list in geom_by_type.items():
-
-                    # get tile shape and tie point
-                    _, _, rows, cols = tile['block_coords']
-                    tie_pt_x, tie_pt_y = tile['tie_point']
-
-                    # create tile empty raster in memory
-                    target_ds = gdal.GetDriverByName('MEM').Create('tmp',
-                                                                   cols,
-                                                                   rows,
-                                                                   1,
-                                                                   gdal.GDT_UInt16)
-
-                    # set pixel size and tie point
-                    target_ds.SetGeoTransform((tie_pt_x,
-                                               self.transform[1],
-                                               0,
-                                               tie_pt_y,
-                                               0,
-                                               self.transform[5]))
-
-                    # set raster projection
-                    target_ds.SetProjection(self.crs_string)
-
-                    # create vector in memory
-                    burn_driver = ogr.GetDriverByName('Memory')
-                    burn_datasource = burn_driver.CreateDataSource('mem_source')
-                    burn_spref = osr.SpatialReference()
-                    burn_spref.ImportFromWkt(self.crs_string)
-                    burn_layer = burn_datasource.CreateLayer('tmp_lyr',
-                                                             srs=burn_spref,
-                                                             geom_type=geom_type)
-
-                    # attributes
-                    fielddefn = ogr.FieldDefn('fid', ogr.OFTInteger)
-                    result = burn_layer.CreateField(fielddefn)
-                    layerdef = burn_layer.GetLayerDefn()
-
-                    geom_burn_val = 0
-                    geom_dict = {}
-                    for geom_id, geom in geom_list:
-                        # create features in layer
-                        temp_feature = ogr.Feature(layerdef)
-                        temp_feature.SetGeometry(geom)
-                        temp_feature.SetField('fid', geom_burn_val)
-                        burn_layer.CreateFeature(temp_feature)
-                        geom_dict[geom_burn_val] = geom_id
-                        geom_burn_val += 1
-
-                    gdal.RasterizeLayer(target_ds,
-                                        [1],
-                                        burn_layer,
-                                        None,  # transformer
-                                        None,  # transform
-                                        [1],
-                                        ['ALL_TOUCHED=TRUE',
-                                         'ATTRIBUTE=FID'])
-
-                    # read mask band as array
-                    temp_band = target_ds.GetRasterBand(1)
-                    mask_arr = temp_band.ReadAsArray()
-
-                    for geom_burn_val, geom_id in geom_dict.items():
-
-                        # make list of unmasked pixels
-                        pixel_xy_loc = list([y, x] for y, x in np.transpose(np.where(mask_arr == geom_burn_val)))
-
-                        if pass_pixel_coords:
-                            # get coordinates
-                            out_geom_extract[geom_id]['coordinates'] += self.get_coords(pixel_xy_loc,
-                                                                                        (self.transform[1],
-                                                                                         self.transform[5]),
-                                                                                        tile['tie_point'],
-                                                                                        pixel_center)
-
-                        # get band values from tile array
-                        out_geom_extract[geom_id]['values'] += list(tile_arr[band_order, x, y].tolist()
-                                                                    for x, y in pixel_xy_loc)
-            warned = False
-            if reducer is not None:
-                for geom_id, geom_dict in out_geom_extract.items():
-                    if reducer == 'mean':
-                        geom_dict['values'] = np.mean(geom_dict['values'], axis=0).tolist()
-                        geom_dict['coordinates'] = np.mean(geom_dict['coordinates'], axis=0).tolist()
-                    elif reducer == 'median':
-                        geom_dict['values'] = np.median(geom_dict['values'], axis=0).tolist()
-                        geom_dict['coordinates'] = np.median(geom_dict['coordinates'], axis=0).tolist()
-                    elif reducer == 'min':
-                        geom_dict['values'] = np.min(geom_dict['values'], axis=0).tolist()
-                        geom_dict['coordinates'] = np.min(geom_dict['coordinates'], axis=0).tolist()
-                    elif reducer == 'max':
-                        geom_dict['values'] = np.max(geom_dict['values'], axis=0).tolist()
-                        geom_dict['coordinates'] = np.max(geom_dict['coordinates'], axis=0).tolist()
-                    elif 'percentile' in reducer:
-                        pctl = int(reducer.split('_')[1])
-                        geom_dict['values'] = np.percentile(geom_dict['values'], [pctl], axis=0).tolist()
-                        geom_dict['coordinates'] = np.percentile(geom_dict['coordinates'], [pctl], axis=0).tolist()
-                    else:
-                        if not warned:
-                            warnings.warn('reducer = {} is not implemented'.format(reducer))
-                            warned = True
-
-                    out_geom_extract[geom_id] = geom_dict
+            if pass_pixel_coords:
+                coordinates = _rows_in_use(geom_coords[internal_id], 2, np.float64)
+            else:
+                coordinates = None
+
+            # reduce the values and coordinates of the geometry
+            if reducer_func is not None:
+                values = reducer_func(values, axis=0)
+                if coordinates is not None:
+                    coordinates = reducer_func(coordinates, axis=0)
+
+            elif pctl is not None:
+                values = np.percentile(values, [pctl], axis=0)
+                if coordinates is not None:
+                    coordinates = np.percentile(coordinates, [pctl], axis=0)
+
+            out_geom_extract[internal_id] = {'values': values.tolist(),
+                                             'coordinates': [] if coordinates is None else coordinates.tolist()}
 
         return out_geom_extract
 
@@ -1378,6 +2553,8 @@ class MultiRaster:
     Virtual raster class to manipulate GDAL virtual raster object
     """
 
+    _vrt_options_cache = dict()  # frozen vrt_dict : gdal.BuildVRTOptions
+
     def __init__(self,
                  filelist=None,
                  initialize=True,
@@ -1404,6 +2581,7 @@ class MultiRaster:
                 self.rasters.append(ras)
 
         self.intersection = None
+        self._intersection_cache = dict()  # tuple of raster indices : intersection bounds
         self.nodatavalue = list(raster.nodatavalue for raster in self.rasters)
         self.resolutions = list((raster.transform[1], raster.transform[5]) for raster in self.rasters)
 
@@ -1416,48 +2594,125 @@ class MultiRaster:
         :param _return: Should the method return the bound coordinates
         :return: coordinates of intersection (minx, miny, maxx, maxy)
         """
-
-        wkt_list = list()
-        if index is not None:
-            for ii in index:
-                bounds = self.rasters[ii].get_bounds()
-                wktstring = 'POLYGON(({}))'.format(', '.join(list(' '.join([str(x), str(y)])
-                                                                  for (x, y) in bounds)))
-                wkt_list.append(wktstring)
-        else:
-            for raster in self.rasters:
-                bounds = raster.get_bounds()
-                wktstring = 'POLYGON(({}))'.format(', '.join(list(' '.join([str(x), str(y)])
-                                                                  for (x, y) in bounds)))
-                wkt_list.append(wktstring)
-
-        geoms = list(ogr.CreateGeometryFromWkt(wktstring) for wktstring in wkt_list)
-
-        temp_geom = geoms[0]
-
-        for geom in geoms[1:]:
-            temp_geom = temp_geom.Intersection(geom)
-
-        temp_geom = temp_geom.ExportToWkt()
-
-        temp_coords = list(list(float(elem.strip()) for elem in elem_.strip()
-                                                                     .split(' '))
-                           for elem_ in temp_geom.replace('POLYGON', '')
-                                                 .replace('((', '')
-                                                 .replace('))', '')
-                                                 .split(','))
-
-        minx = min(list(coord[0] for coord in temp_coords))
-        miny = min(list(coord[1] for coord in temp_coords))
-
-        maxx = max(list(coord[0] for coord in temp_coords))
-        maxy = max(list(coord[1] for coord in temp_coords))
+        key = tuple(index) if index is not None else tuple(range(len(self.rasters)))
+
+        if key in self._intersection_cache:
+            self.intersection = self._intersection_cache[key]
+            if _return:
+                return self.intersection
+            return
+
+        rasters = list(self.rasters[ii] for ii in key)
+        for raster in rasters:
+            raster._ensure_geo()
+
+        # rasters on the same grid and CRS (e.g. bands of one scene) share their extent
+        fingerprints = set((tuple(raster.transform), tuple(raster.shape[1:]), raster.crs_string)
+                           for raster in rasters)
+        if len(fingerprints) == 1:
+            rasters = rasters[:1]
+
+        north_up = list(raster.transform[2] == 0 and raster.transform[4] == 0 for raster in rasters)
+
+        # corner coordinates of the rotated footprints
+        footprints = list()
+        for raster, is_north_up in zip(rasters, north_up):
+            if not is_north_up:
+                rows, cols = raster.shape[1], raster.shape[2]
+                footprints.append(list(gdal.ApplyGeoTransform(raster.transform, px, py)
+                                       for px, py in ((0, 0), (cols, 0), (cols, rows), (0, rows), (0, 0))))
+
+        # bounding boxes (minx, maxx, miny, maxy) of all rasters, disjoint boxes need no polygon intersection
+        bboxes = np.empty((len(rasters), 4), dtype=np.float64)
+        north_up_mask = np.array(north_up, dtype=bool)
+        if any(north_up):
+            bboxes[north_up_mask] = list(raster.get_bounds(xy_coordinates=False)
+                                         for raster, is_north_up in zip(rasters, north_up) if is_north_up)
+        if footprints:
+            corners = np.array(footprints, dtype=np.float64)
+            bboxes[~north_up_mask] = np.column_stack([corners[:, :, 0].min(axis=1),
+                                                      corners[:, :, 0].max(axis=1),
+                                                      corners[:, :, 1].min(axis=1),
+                                                      corners[:, :, 1].max(axis=1)])
+
+        if bboxes[:, 0].max() >= bboxes[:, 1].min() or bboxes[:, 2].max() >= bboxes[:, 3].min():
+            raise ValueError('Raster bounds do not intersect')
+
+        if any(north_up):
+            # north-up rasters: the intersection of the bounding boxes
+            north_up_bboxes = bboxes[north_up_mask]
+
+            minx, miny = north_up_bboxes[:, 0].max(), north_up_bboxes[:, 2].max()
+            maxx, maxy = north_up_bboxes[:, 1].min(), north_up_bboxes[:, 3].min()
+
+        if not all(north_up):
+            # rotated rasters: intersect the footprint polygons, and the box of the north-up rasters
+            geoms = footprints
+
+            if any(north_up):
+                geoms.append([(minx, maxy), (maxx, maxy), (maxx, miny), (minx, miny), (minx, maxy)])
+
+            polygons = list()
+            for ring_coords in geoms:
+                ring = ogr.Geometry(ogr.wkbLinearRing)
+                for x, y in ring_coords:
+                    ring.AddPoint_2D(x, y)
+                polygon = ogr.Geometry(ogr.wkbPolygon)
+                polygon.AddGeometry(ring)
+                polygons.append(polygon)
+
+            # drop vertices closer than half a pixel from dense footprints
+            tolerance = 0.5 * min(raster.xpixel for raster in rasters)
+            polygons = list(polygon.SimplifyPreserveTopology(tolerance)
+                            if polygon.GetGeometryRef(0).GetPointCount() > _MAX_FOOTPRINT_VERTICES else polygon
+                            for polygon in polygons)
+
+            # smallest first, so the intersection stays small
+            polygons.sort(key=lambda polygon: polygon.GetArea())
+
+            temp_geom = polygons[0]
+            for polygon in polygons[1:]:
+                temp_geom = temp_geom.Intersection(polygon)
+                if temp_geom.IsEmpty():
+                    break
+
+            if temp_geom.IsEmpty():
+                raise ValueError('Raster bounds do not intersect')
+
+            minx, maxx, miny, maxy = temp_geom.GetEnvelope()
+
+        if minx >= maxx or miny >= maxy:
+            raise ValueError('Raster bounds do not intersect')
+
+        minx, miny, maxx, maxy = float(minx), float(miny), float(maxx), float(maxy)
 
         self.intersection = (minx, miny, maxx, maxy)
+        self._intersection_cache[key] = self.intersection
 
         if _return:
             return self.intersection
 
+    @classmethod
+    def _vrt_options(cls,
+                     vrt_dict):
+        """
+        Get gdal.BuildVRTOptions for a dictionary of options, reusing options built before
+        :param vrt_dict: dictionary of gdal.BuildVRTOptions keyword arguments
+        :return: gdal.BuildVRTOptions object
+        """
+        key = tuple(sorted((name, tuple(value) if isinstance(value, (list, tuple)) else value)
+                           for name, value in vrt_dict.items()))
+
+        vrt_opt = cls._vrt_options_cache.pop(key, None)
+        if vrt_opt is None:
+            vrt_opt = gdal.BuildVRTOptions(**vrt_dict)
+            if len(cls._vrt_options_cache) >= _MAX_VRT_OPTIONS:
+                del cls._vrt_options_cache[next(iter(cls._vrt_options_cache))]
+
+        # most recently used last
+        cls._vrt_options_cache[key] = vrt_opt
+        return vrt_opt
+
     def layerstack(self,
                    order=None,
                    verbose=False,
@@ -1488,9 +2743,12 @@ class MultiRaster:
         if 'output_bounds' in kwargs:
             vrt_dict['outputBounds'] = kwargs['output_bounds']
         else:
-            vrt_dict['outputBounds'] = self.intersection
+            if verbose:
+                Opt.cprint('Getting bounds ...')
+
+            vrt_dict['outputBounds'] = self.get_intersection(index=order)
 
-        output_res = min(list(np.abs(self.resolutions[i][0]) for i in order))
+        output_res = float(np.abs(np.asarray(self.resolutions, dtype=np.float64)[list(order), 0]).min())
 
         if 'outputresolution' in kwargs:
             vrt_dict['xRes'] = kwargs['outputresolution'][0]
@@ -1499,40 +2757,33 @@ class MultiRaster:
             vrt_dict['xRes'] = output_res
             vrt_dict['yRes'] = output_res
 
-        if 'nodatavalue' in kwargs:
-            vrt_dict['srcNodata'] = kwargs['nodatavalue']
-        else:
-            vrt_dict['srcNodata'] = self.nodatavalue[0]
-
-        if 'outnodatavalue' in kwargs:
-            vrt_dict['VRTNodata'] = kwargs['outnodatavalue']
-        else:
-            vrt_dict['VRTNodata'] = self.nodatavalue[0]
+        nodatavalue = self.nodatavalue[0]
+        vrt_dict['srcNodata'] = kwargs.get('nodatavalue', nodatavalue)
+        vrt_dict['VRTNodata'] = kwargs.get('outnodatavalue', nodatavalue)
 
         if 'resample' in kwargs:
             vrt_dict['resampleAlg'] = kwargs['resample']
         else:
             vrt_dict['resampleAlg'] = 'cubic'
 
-        if verbose:
-            Opt.cprint('Getting bounds ...')
-
-        vrt_dict['outputBounds'] = self.get_intersection(index=order)
         vrt_dict['separate'] = True
         vrt_dict['hideNodata'] = False
 
+        files = [self.filelist[i] for i in order]
+
         if verbose:
-            Opt.cprint('Files: \n{}'.format('\n'.join(list(self.filelist[i] for i in order))))
+            Opt.cprint('Files: \n{}'.format('\n'.join(files)))
 
-        _vrt_opt_ = gdal.BuildVRTOptions(**vrt_dict)
+        _vrt_opt_ = self._vrt_options(vrt_dict)
 
         if outfile is None:
-            vrtfile = Handler(self.filelist[0]).dirname + Handler().sep + 'layerstack1.vrt'
-            outfile = Handler(self.filelist[0]).dirname + Handler().sep + 'layerstack1.tif'
+            outdir = os.path.dirname(self.filelist[0])
+            vrtfile = os.path.join(outdir, 'layerstack1.vrt')
+            outfile = os.path.join(outdir, 'layerstack1.tif')
         else:
-            vrtfile = outfile.split('.tif')[0] + '.vrt'
+            vrtfile = os.path.splitext(outfile)[0] + '.vrt'
 
-        _vrt_ = gdal.BuildVRT(vrtfile, list(self.filelist[i] for i in order), options=_vrt_opt_)
+        _vrt_ = gdal.BuildVRT(vrtfile, files, options=_vrt_opt_)
 
         if not return_vrt:
             if verbose:
@@ -1559,8 +2810,10 @@ class MultiRaster:
         :param layer_indices: list of layer indices
         :param verbose: If some of the steps should be printed to console
         :param outfile: Name of the output file (.tif)
-        :param tile_size: Size of internal tile
-        :param write_raster: If the raster file should be written or a raster object be returned
+        :param tile_size: Size of internal tile (default: 1024), or 'auto' for whole blocks of the layer stack
+                          filling about half of the L2 cache for all layers of a tile, with at least 512x512 pixels
+        :param write_raster: If the raster file should be written or a raster object be returned,
+                             a written file is filled tile by tile without holding the whole composite in memory
         :param composite_type: mean, median, pctl_xxx (eg: pctl_5, pctl_99, pctl_100, etc.),
         :return: None
         """
@@ -1582,61 +2835,179 @@ class MultiRaster:
         lras.datasource = _ls_vrt_
         lras.initialize()
 
+        if tile_size == 'auto':
+            # blocks of the first raster line up with the tiles only if the stack keeps its grid
+            first_raster = self.rasters[layer_indices[0]]
+            if first_raster.block_size is not None and \
+                    tuple(first_raster.transform) == tuple(lras.transform) and \
+                    tuple(first_raster.shape[1:]) == tuple(lras.shape[1:]):
+                block_size = first_raster.block_size
+            else:
+                block_size = lras.block_size
+            tile_xsize, tile_ysize = _cache_tile_size(block_size,
+                                                      (lras.shape[2], lras.shape[1]),
+                                                      len(t_order) * np.dtype(lras._np_dtype).itemsize)
+        else:
+            tile_xsize = tile_ysize = tile_size
+
         if 'bound_coords' in kwargs:
             if 'coords_type' in kwargs:
-                lras.make_tile_grid(tile_size,
-                                    tile_size,
+                lras.make_tile_grid(tile_xsize,
+                                    tile_ysize,
                                     bound_coords=kwargs['bound_coords'],
                                     coords_type=kwargs['coords_type'])
             else:
-                lras.make_tile_grid(tile_size,
-                                    tile_size,
+                lras.make_tile_grid(tile_xsize,
+                                    tile_ysize,
                                     bound_coords=kwargs['bound_coords'],
                                     coords_type='crs')
         else:
-            lras.make_tile_grid(tile_size,
-                                tile_size)
+            lras.make_tile_grid(tile_xsize,
+                                tile_ysize)
 
         Opt.cprint(lras)
 
-        # make numpy array to hold the final result
-        out_arr = np.zeros((lras.shape[1], lras.shape[2]),
-                           dtype=gdal_array.GDALTypeCodeToNumericTypeCode(lras.dtype))
-
-        # loop through raster tiles
-        count = 0
-        for tie_pt, tile_arr in lras.get_next_tile(bands=t_order):
-
-            Opt.cprint(lras.tile_grid[count]['block_coords'])
-
-            _x, _y, _cols, _rows = lras.tile_grid[count]['block_coords']
-
-            if composite_type == 'mean':
-                temp_arr = np.apply_along_axis(lambda x: np.mean(x[x != lras.nodatavalue]), 0, tile_arr)
-            elif composite_type == 'median':
-                temp_arr = np.apply_along_axis(lambda x: np.median(x[x != lras.nodatavalue]), 0, tile_arr)
-            elif composite_type == 'min':
-                temp_arr = np.apply_along_axis(lambda x: np.min(x[x != lras.nodatavalue]), 0, tile_arr)
-            elif composite_type == 'max':
-                temp_arr = np.apply_along_axis(lambda x: np.max(x[x != lras.nodatavalue]), 0, tile_arr)
-            elif 'pctl' in composite_type:
-                pctl = int(composite_type.split('_')[1])
-                temp_arr = np.apply_along_axis(lambda x: np.percentile(x[x != lras.nodatavalue], pctl), 0, tile_arr)
-            else:
+        if write_raster:
+            if outfile is None:
+                outfile = Handler(filename=lras.name).file_remove_check()
+
+            # output file written as tiles complete
+            out_ds = _GTIFF_DRIVER.Create(outfile, lras.shape[2], lras.shape[1], 1, lras.dtype,
+                                          lras._creation_options(lras.dtype))
+            out_ds.SetGeoTransform(lras.transform)
+            out_ds.SetProjection(lras.crs_string)
+
+            out_band = out_ds.GetRasterBand(1)
+            out_band.SetDescription(composite_type)
+            if lras.nodatavalue is not None:
+                out_band.SetNoDataValue(lras.nodatavalue)
+
+            out_arr = None
+        else:
+            # make numpy array to hold the final result
+            out_band = None
+            out_arr = np.zeros((lras.shape[1], lras.shape[2]),
+                               dtype=lras._np_dtype)
+
+        # reducer along the layer axis, layers equal to nodata are ignored
+        composite_func = _COMPOSITE_REDUCERS.get(composite_type)
+        pctl = None
+
+        if composite_func is None:
+            pctl_match = _COMPOSITE_PCTL_RE.match(composite_type)
+            if pctl_match is None:
                 raise ValueError('Unknown composite option')
+            pctl = int(pctl_match.group(1))
+
+        op_code, op_pctl = _COMPOSITE_OPS[composite_type] if pctl is None else (3, float(pctl))
+
+        work_dtype = np.result_type(lras._np_dtype, np.float32)
+        fill_value = lras.nodatavalue if lras.nodatavalue is not None else 0
+        max_cols, max_rows = lras.tile_block_coords[:, 2:].max(axis=0).tolist()
+
+        # float outputs are reduced in place, others through a float array holding NaN for missing values
+        out_dtype = np.dtype(lras._np_dtype)
+        reduce_in_place = out_arr is not None and out_dtype == work_dtype
+        thread_data = threading.local()
+
+        def composite_tile(tile_arr,
+                           block_coords):
+            _x, _y, _cols, _rows = block_coords
+
+            if tile_arr.ndim == 2:
+                tile_arr = tile_arr[np.newaxis, :, :]
+
+            if reduce_in_place:
+                temp_arr = out_arr[_y: (_y+_rows), _x: (_x+_cols)]
+            else:
+                temp_arr = np.empty((_rows, _cols), dtype=work_dtype)
+
+            if _composite_kernel is not None:
+                # compiled per pixel reduction, skipping nodata without a masked copy of the tile
+                _composite_kernel(tile_arr,
+                                  fill_value,
+                                  lras.nodatavalue is not None,
+                                  op_code,
+                                  op_pctl,
+                                  temp_arr)
+            else:
+                # nodata layers as NaN, reduced in one call over the whole tile.
+                # Each thread reuses one value buffer and one mask buffer sized for the largest tile
+                if not hasattr(thread_data, 'masked_buf'):
+                    thread_data.masked_buf = np.empty(len(t_order) * max_cols * max_rows, dtype=work_dtype)
+                    thread_data.mask_buf = np.empty(len(t_order) * max_cols * max_rows, dtype=np.bool_)
+
+                masked = thread_data.masked_buf[:tile_arr.size].reshape(tile_arr.shape)
+                np.copyto(masked, tile_arr)
+                if lras.nodatavalue is not None:
+                    nodata_mask = thread_data.mask_buf[:tile_arr.size].reshape(tile_arr.shape)
+                    np.equal(tile_arr, lras.nodatavalue, out=nodata_mask)
+                    np.copyto(masked, np.nan, where=nodata_mask)
+
+                if pctl is None:
+                    composite_func(masked, axis=0, out=temp_arr)
+                else:
+                    np.nanpercentile(masked, pctl, axis=0, out=temp_arr)
+
+            temp_arr[np.isnan(temp_arr)] = fill_value
+
+            if out_arr is None:
+                # written to file by the calling thread
+                return temp_arr.astype(out_dtype, copy=False)
+
+            # update output array with tile composite, tiles do not overlap
+            if not reduce_in_place:
+                out_arr[_y: (_y+_rows), _x: (_x+_cols)] = temp_arr
+
+        def finish_tile(future,
+                        block_coords):
+            tile_result = future.result()
+            if out_band is not None:
+                out_band.WriteArray(tile_result, block_coords[0], block_coords[1])
+
+        # tiles are reduced in background threads while the next tile is read.
+        # The compiled kernel is already parallel over rows, so it runs in one thread
+        if _composite_kernel is not None:
+            nworkers = 1
+        else:
+            nworkers = max(1, os.cpu_count() or 1)
+
+        executor = ThreadPoolExecutor(max_workers=nworkers)
+        pending = deque()
+
+        try:
+            with warnings.catch_warnings():
+                # pixels with nodata in all layers reduce to NaN
+                warnings.simplefilter('ignore', RuntimeWarning)
+
+                # loop through raster tiles, each tile read into its own array
+                count = 0
+                for tie_pt, tile_arr in lras.get_next_tile(bands=t_order,
+                                                           reuse_buffer=False):
+
+                    block_coords = lras.tile_block_coords[count].tolist()
+
+                    Opt.cprint(tuple(block_coords))
 
-            # update output array with tile composite
-            out_arr[_y: (_y+_rows), _x: (_x+_cols)] = temp_arr
-            count += 1
+                    # limit the tiles held in memory, finished tiles are written in order
+                    if len(pending) >= 2 * nworkers:
+                        finish_tile(*pending.popleft())
 
-        # write array to raster
-        lras.array = out_arr
+                    pending.append((executor.submit(composite_tile, tile_arr, block_coords), block_coords))
+                    count += 1
+
+                while len(pending) > 0:
+                    finish_tile(*pending.popleft())
+        finally:
+            executor.shutdown(wait=True)
 
         if write_raster:
-            # write raster
-            lras.write_to_file(outfile)
+            out_ds.FlushCache()
+            out_band = out_ds = None
             Opt.cprint('Written {}'.format(outfile))
         else:
+            # write array to raster
+            lras.array = out_arr
             return lras
 
     def mosaic(self,
@@ -1760,6 +3131,140 @@ class Terrain(Raster):
         if self.shape is not None:
             return 'Terrain ' + super(Terrain, self).__repr__()
 
+    def compute_all(self,
+                    outfiles,
+                    band=0,
+                    algorithm='Horn',
+                    slope_format='degree',
+                    scale=None,
+                    z_factor=1,
+                    azimuth=315,
+                    altitude=90,
+                    zero_for_flat=True,
+                    tile_rows=512,
+                    **creation_options):
+        """
+        Method to calculate slope, aspect, and hillshade in one pass over the DEM.
+        The DEM is read once in strips of rows, and the gradients of each pixel are computed once for all outputs.
+        Pixels on the raster edges or next to nodata are set to nodata (-9999 for slope and aspect, 0 for hillshade).
+        Hillshade values are scaled to 1-255 as in Terrain.hillshade
+        :param outfiles: Dictionary of output file names with any of the keys 'slope', 'aspect', 'hillshade'
+        :param band: Band index to use (default: 0)
+        :param algorithm: slope algorithm to use
+                          valid options:
+                             4-neighbor: 'ZevenbergenThorne'
+                             8-neighbor: 'Horn'
+        :param slope_format: format of the slope raster (valid options: 'degree', or 'percent')
+        :param scale: ratio of vertical to horizontal units
+        :param z_factor: vertical exaggeration used to pre-multiply the elevations for hillshade. (default: 1)
+        :param azimuth: azimuth of the light, in degrees. (default: 315)
+        :param altitude: altitude of the light, in degrees. (default: 90)
+        :param zero_for_flat: whether to return 0 for flat areas with slope=0 in aspect, instead of -9999.
+        :param tile_rows: Number of rows read and processed at a time (default: 512)
+        :param creation_options: Valid creation options examples:
+                                 compress='LZW'
+                                 bigtiff='yes'
+        :return: None
+        """
+        if len(outfiles) == 0 or not set(outfiles).issubset(('slope', 'aspect', 'hillshade')):
+            raise ValueError("Outputs should be one or more of 'slope', 'aspect', 'hillshade'")
+
+        if not self.init:
+            self.initialize()
+
+        rows, cols = self.shape[1], self.shape[2]
+        if scale is None:
+            scale = 1.0
+
+        dem_band = self.datasource.GetRasterBand(band + 1)
+        nodata = dem_band.GetNoDataValue()
+
+        # output files
+        out_dtypes = {'slope': gdal.GDT_Float32, 'aspect': gdal.GDT_Float32, 'hillshade': gdal.GDT_Byte}
+        out_nodata = {'slope': -9999.0, 'aspect': -9999.0, 'hillshade': 0}
+
+        out_bands = dict()
+        out_fileptrs = list()
+        for output, outfile in outfiles.items():
+            fileptr = _GTIFF_DRIVER.Create(outfile, cols, rows, 1, out_dtypes[output],
+                                           self._creation_options(out_dtypes[output], **creation_options))
+            fileptr.SetGeoTransform(self.transform)
+            fileptr.SetProjection(self.crs_string)
+
+            out_band = fileptr.GetRasterBand(1)
+            out_band.SetNoDataValue(out_nodata[output])
+            out_band.SetDescription(output)
+
+            out_bands[output] = out_band
+            out_fileptrs.append(fileptr)
+
+        # strip outputs for the largest strip
+        strip_rows = min(tile_rows, rows)
+        slope_buf = np.empty((strip_rows, cols), dtype=np.float32)
+        aspect_buf = np.empty((strip_rows, cols), dtype=np.float32)
+        hillshade_buf = np.empty((strip_rows, cols), dtype=np.uint8)
+        out_bufs = {'slope': slope_buf, 'aspect': aspect_buf, 'hillshade': hillshade_buf}
+
+        executor = ThreadPoolExecutor(max_workers=len(out_bands))
+        try:
+            for row_start in range(0, rows, strip_rows):
+                row_end = min(rows, row_start + strip_rows)
+
+                # strip with a one row halo where available, kept in the DEM data type.
+                # Integer and float32 DEMs are converted per value in the kernel, not copied to float64
+                read_start, read_end = max(0, row_start - 1), min(rows, row_end + 1)
+                strip = dem_band.ReadAsArray(0, read_start, cols, read_end - read_start)
+
+                if strip.dtype.kind in 'fc':
+                    invalid = ~np.isfinite(strip)
+                else:
+                    invalid = np.zeros(strip.shape, dtype=bool)
+                if nodata is not None:
+                    invalid |= strip == nodata
+
+                # pixels outside the raster are invalid
+                pad = ((1 - (row_start - read_start), 1 - (read_end - row_end)), (1, 1))
+                strip = np.pad(strip, pad, mode='constant', constant_values=0)
+                invalid = np.pad(invalid, pad, mode='constant', constant_values=True)
+
+                nrows = row_end - row_start
+                strip_outs = dict((output, out_buf[:nrows]) for output, out_buf in out_bufs.items())
+
+                _terrain_kernel(strip,
+                                invalid,
+                                float(self.xpixel) * scale,
+                                float(self.ypixel) * scale,
+                                algorithm == 'Horn',
+                                float(z_factor),
+                                np.radians(90.0 - altitude),
+                                np.radians((450.0 - azimuth) % 360.0),
+                                slope_format == 'percent',
+                                0.0 if zero_for_flat else -9999.0,
+                                strip_outs['slope'],
+                                strip_outs['aspect'],
+                                strip_outs['hillshade'])
+
+                # write the strip to all outputs, each output has its own dataset
+                list(executor.map(lambda output: out_bands[output].WriteArray(strip_outs[output], 0, row_start),
+                                  list(out_bands)))
+        finally:
+            executor.shutdown(wait=True)
+
+        for out_band in out_bands.values():
+            out_band.FlushCache()
+
+        out_bands = None
+        out_fileptrs = None
+
+    @staticmethod
+    def _creation_option_list(creation_options):
+        """
+        Method to convert creation options to the list of strings used by GDAL
+        :param creation_options: Dictionary of creation options e.g. {'compress': 'LZW'}
+        :return: List of 'KEY=VALUE' strings
+        """
+        return list('{}={}'.format(str(key).upper(), str(value)) for key, value in creation_options.items())
+
     def slope(self,
               outfile=None,
               slope_format='degree',
@@ -1789,9 +3294,7 @@ class Terrain(Raster):
                                  bigtiff='yes'
         """
 
-        creation_option_list = list()
-        for key, value in creation_options.items():
-            creation_option_list.append('{}={}'.format(str(key).upper(), str(value).upper()))
+        creation_option_list = self._creation_option_list(creation_options)
 
         slope_opts = gdal.DEMProcessingOptions(format=file_format,
                                                computeEdges=compute_edges,
@@ -1840,9 +3343,7 @@ class Terrain(Raster):
                                  bigtiff='yes'
         """
 
-        creation_option_list = list()
-        for key, value in creation_options.items():
-            creation_option_list.append('{}={}'.format(str(key), str(value)))
+        creation_option_list = self._creation_option_list(creation_options)
 
         aspect_opts = gdal.DEMProcessingOptions(format=file_format,
                                                 computeEdges=compute_edges,
@@ -1886,9 +3387,7 @@ class Terrain(Raster):
                                  bigtiff='yes'
         """
 
-        creation_option_list = list()
-        for key, value in creation_options.items():
-            creation_option_list.append('{}={}'.format(str(key), str(value)))
+        creation_option_list = self._creation_option_list(creation_options)
 
         tpi_opts = gdal.DEMProcessingOptions(format=file_format,
                                              computeEdges=compute_edges,
@@ -1930,9 +3429,7 @@ class Terrain(Raster):
                                  bigtiff='yes'
         """
 
-        creation_option_list = list()
-        for key, value in creation_options.items():
-            creation_option_list.append('{}={}'.format(str(key), str(value)))
+        creation_option_list = self._creation_option_list(creation_options)
 
         tpi_opts = gdal.DEMProcessingOptions(format=file_format,
                                              computeEdges=compute_edges,
@@ -1974,9 +3471,7 @@ class Terrain(Raster):
                                  bigtiff='yes'
         """
 
-        creation_option_list = list()
-        for key, value in creation_options.items():
-            creation_option_list.append('{}={}'.format(str(key), str(value)))
+        creation_option_list = self._creation_option_list(creation_options)
 
         tpi_opts = gdal.DEMProcessingOptions(format=file_format,
                                              computeEdges=compute_edges,
@@ -2037,9 +3532,7 @@ class Terrain(Raster):
         """
 
 
-        creation_option_list = list()
-        for key, value in creation_options.items():
-            creation_option_list.append('{}={}'.format(str(key), str(value)))
+        creation_option_list = self._creation_option_list(creation_options)
 
         tpi_opts = gdal.DEMProcessingOptions(format=file_format,
                                              computeEdges=compute_edges,
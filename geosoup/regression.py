@@ -243,8 +243,9 @@ class _Regressor(object):
             Opt.cprint('\nProcessing {} raster tiles...\n'.format(str(raster_obj.ntiles)))
 
         count = 0
-        for _, tile_arr in raster_obj.get_next_tile():
-            tiept_x, tiept_y, tile_cols, tile_rows = raster_obj.tile_grid[count]['block_coords']
+        # each tile is consumed within its iteration
+        for _, tile_arr in raster_obj.get_next_tile(reuse_buffer=True):
+            tiept_x, tiept_y, tile_cols, tile_rows = raster_obj.tile_block_coords[count].tolist()
 
             if defaults['verbose']:
                 Opt.cprint("\nProcessing tile {} of {}: x {}, y {}, cols {}, rows {}".format(str(count + 1),
@@ -342,29 +342,23 @@ class Vector(object):
         :return: WKT string representation
         """
 
-        if geom_type.upper() == 'POINT':
-            tempstring = ' '.join([str(coord) for coord in coords])
-            wktstring = 'POINT({})'.format(tempstring)
+        geom_type = geom_type.upper()
 
-        elif geom_type.upper() == 'MULTIPOINT':
-            tempstring = '), ('.join(list(' '.join([str(x), str(y)]) for (x, y) in coords))
-            wktstring = 'MULTIPOINT(({}))'.format(tempstring)
+        if geom_type == 'POINT':
+            wktstring = 'POINT({})'.format(' '.join(str(coord) for coord in coords))
 
-        elif geom_type.upper() == 'POLYGON':
+        elif geom_type == 'MULTIPOINT':
+            wktstring = 'MULTIPOINT(({}))'.format('), ('.join(str(x) + ' ' + str(y) for (x, y) in coords))
 
-            tempstring = ', '.join(list(' '.join([str(x), str(y)]) for (x, y) in coords))
-            wktstring = 'POLYGON(({}))'.format(tempstring)
+        elif geom_type == 'POLYGON':
+            wktstring = 'POLYGON(({}))'.format(', '.join(str(x) + ' ' + str(y) for (x, y) in coords))
 
-        elif geom_type.upper() == 'MULTIPOLYGON':
+        elif geom_type == 'MULTIPOLYGON':
+            wktstring = 'MULTIPOLYGON((({})))'.format('), ('.join(', '.join(str(x) + ' ' + str(y) for (x, y) in coord)
+                                                                  for coord in coords))
 
-            tempstring = '), ('.join(', '.join(list(' '.join([str(x), str(y)]) for (x, y) in coord))
-                                     for coord in coords)
-            wktstring = 'MULTIPOLYGON((({})))'.format(tempstring)
-
-        elif geom_type.upper() == 'LINESTRING' or geom_type.upper() == 'LINE':
-
-            tempstring = ', '.join(list(' '.join([str(x), str(y)]) for (x, y) in coords))
-            wktstring = 'LINESTRING({})'.format(tempstring)
+        elif geom_type == 'LINESTRING' or geom_type == 'LINE':
+            wktstring = 'LINESTRING({})'.format(', '.join(str(x) + ' ' + str(y) for (x, y) in coords))
 
         else:
             raise ValueError("Unknown geometry type")
@@ -1150,10 +1144,8 @@ class Vector(object):
                                             geom_type='polygon')
         bounds_geom = Vector.get_osgeo_geom(bounds_wkt)
 
-        bounds_maxx = max(list(coord[0] for coord in temp_coords_list))
-        bounds_minx = min(list(coord[0] for coord in temp_coords_list))
-        bounds_maxy = max(list(coord[1] for coord in temp_coords_list))
-        bounds_miny = min(list(coord[1] for coord in temp_coords_list))
+        coords_arr = np.asarray(list(coord[:2] for coord in temp_coords_list), dtype=np.float64)
+        (bounds_minx, bounds_miny), (bounds_maxx, bounds_maxy) = coords_arr.min(axis=0), coords_arr.max(axis=0)
 
         xcoords = Sublist.frange(bounds_minx, bounds_maxx, div=div)
         ycoords = Sublist.frange(bounds_miny, bounds_maxy, div=div).reverse()
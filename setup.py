@@ -22,7 +22,7 @@ setuptools.setup(
     install_requires=[
         'psutil>=5.6.2',
         'h5py>=2.10.0',
-        'numpy>=1.16.5',
+        'numpy>=1.20.0',
         'earthengine-api>=0.1.175',
         'scikit-learn>=0.20.3',
         'scipy>=1.2.2',